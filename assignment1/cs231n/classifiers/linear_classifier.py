@@ -5,6 +5,7 @@ from builtins import object
 import numpy as np
 from cs231n.classifiers.linear_svm import *
 from cs231n.classifiers.softmax import *
+from cs231n.samplers import get_sampler
 from past.builtins import xrange
 
 
@@ -14,7 +15,7 @@ class LinearClassifier(object):
         self.W = None
 
     def train(self, X, y, learning_rate=1e-3, reg=1e-5, num_iters=100,
-              batch_size=200, verbose=False):
+              batch_size=200, verbose=False, sampler='random'):
         """
         Train this linear classifier using stochastic gradient descent.
 
@@ -28,6 +29,9 @@ class LinearClassifier(object):
         - num_iters: (integer) number of steps to take when optimizing
         - batch_size: (integer) number of training examples to use at each step.
         - verbose: (boolean) If true, print progress during optimization.
+        - sampler: How minibatches are drawn; a Sampler or the name of one in
+          cs231n/samplers.py ('random', 'permutation', 'stratified' or
+          'contiguous'). Note that 'contiguous' shuffles X and y in place.
 
         Outputs:
         A list containing the value of the loss function at each training iteration.
@@ -39,6 +43,7 @@ class LinearClassifier(object):
             self.W = 0.001 * np.random.randn(dim, num_classes)
 
         # Run stochastic gradient descent to optimize W
+        batches = iter(get_sampler(sampler, X, y, batch_size))
         loss_history = []
         for it in range(num_iters):
             X_batch = None
@@ -57,7 +62,7 @@ class LinearClassifier(object):
             #########################################################################
             # *****START OF YOUR CODE (DO NOT DELETE/MODIFY THIS LINE)*****
 
-            batch_inds = np.random.choice(num_train, batch_size)
+            batch_inds = next(batches)
             X_batch = X[batch_inds, :]
             y_batch = y[batch_inds]
 
@@ -6,6 +6,8 @@ import numpy as np
 import matplotlib.pyplot as plt
 from past.builtins import xrange
 
+from cs231n.samplers import get_sampler
+
 class TwoLayerNet(object):
     """
     A two-layer fully-connected neural network. The net has an input dimension of
@@ -155,7 +157,7 @@ class TwoLayerNet(object):
     def train(self, X, y, X_val, y_val,
               learning_rate=1e-3, learning_rate_decay=0.95,
               reg=5e-6, num_iters=100,
-              batch_size=200, verbose=False):
+              batch_size=200, verbose=False, sampler='random'):
         """
         Train this neural network using stochastic gradient descent.
 
@@ -172,11 +174,15 @@ class TwoLayerNet(object):
         - num_iters: Number of steps to take when optimizing.
         - batch_size: Number of training examples to use per step.
         - verbose: boolean; if true print progress during optimization.
+        - sampler: How minibatches are drawn; a Sampler or the name of one in
+          cs231n/samplers.py ('random', 'permutation', 'stratified' or
+          'contiguous'). Note that 'contiguous' shuffles X and y in place.
         """
         num_train = X.shape[0]
         iterations_per_epoch = max(num_train / batch_size, 1)
 
         # Use SGD to optimize the parameters in self.model
+        batches = iter(get_sampler(sampler, X, y, batch_size))
         loss_history = []
         train_acc_history = []
         val_acc_history = []
@@ -190,7 +196,7 @@ class TwoLayerNet(object):
             # them in X_batch and y_batch respectively.                             #
             #########################################################################
             # *****START OF YOUR CODE (DO NOT DELETE/MODIFY THIS LINE)*****
-            batch_inds = np.random.choice(num_train, batch_size)
+            batch_inds = next(batches)
             
             X_batch = X[batch_inds,:]
             y_batch = y[batch_inds]
@@ -4,8 +4,15 @@ from builtins import range
 from six.moves import cPickle as pickle
 import numpy as np
 import os
+import json
+import multiprocessing
 from scipy.misc import imread
 import platform
+from collections import OrderedDict
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
 
 def load_pickle(f):
     version = platform.python_version_tuple()
@@ -15,65 +22,160 @@ def load_pickle(f):
         return  pickle.load(f, encoding='latin1')
     raise ValueError("invalid python version: {}".format(version))
 
-def load_CIFAR_batch(filename):
-    """ load single batch of cifar """
+def _load_CIFAR_batch_raw(filename):
+    """ load single batch of cifar as raw uint8 of shape (N, 3, 32, 32) """
     with open(filename, 'rb') as f:
         datadict = load_pickle(f)
-        X = datadict['data']
-        Y = datadict['labels']
-        X = X.reshape(10000, 3, 32, 32).transpose(0,2,3,1).astype("float")
-        Y = np.array(Y)
+        X = datadict['data'].reshape(10000, 3, 32, 32)
+        Y = np.array(datadict['labels'])
         return X, Y
 
-def load_CIFAR10(ROOT):
-    """ load all of cifar """
+def _CIFAR_images(X, layout, dtype):
+    """ convert raw (N, 3, 32, 32) cifar images to a layout and dtype """
+    if layout == 'NHWC':
+        X = X.transpose(0,2,3,1)
+    elif layout != 'NCHW':
+        raise ValueError('Invalid layout "%s"' % layout)
+    return X.astype(dtype, copy=False)
+
+def load_CIFAR_batch(filename, layout='NHWC', dtype="float"):
+    """ load single batch of cifar """
+    X, Y = _load_CIFAR_batch_raw(filename)
+    return _CIFAR_images(X, layout, dtype), Y
+
+CIFAR10_CACHE_DIR = 'npy_cache'
+CIFAR10_CACHE_FILES = ('X_train', 'y_train', 'X_test', 'y_test')
+
+def load_CIFAR10(ROOT, cache=False, layout='NHWC', dtype="float"):
+    """
+    load all of cifar
+
+    Inputs:
+    - ROOT: String giving the path to the cifar-10-batches-py directory.
+    - cache: If True the batches are read from the uint8 .npy cache written by
+      cache_CIFAR10 (which is created on first use) instead of being
+      unpickled. The cache is memory-mapped, so loading is nearly free and
+      the pages are shared by every process that maps the same files.
+    - layout: Either 'NHWC' (the default) or 'NCHW'.
+    - dtype: numpy datatype of the returned images. Asking for np.uint8 does
+      not copy the images at all; together with cache=True this returns
+      read-only views onto the memory maps.
+
+    Returns a tuple of:
+    - Xtr, Ytr: Training images of shape (50000, 32, 32, 3) or
+      (50000, 3, 32, 32) depending on layout, and their labels.
+    - Xte, Yte: Test images and labels.
+    """
+    if cache:
+        cache_dir = os.path.join(ROOT, CIFAR10_CACHE_DIR)
+        paths = [os.path.join(cache_dir, '%s.npy' % name)
+                 for name in CIFAR10_CACHE_FILES]
+        if not all(os.path.isfile(path) for path in paths):
+            cache_CIFAR10(ROOT)
+        Xtr, Ytr, Xte, Yte = [np.load(path, mmap_mode='r') for path in paths]
+    else:
+        xs = []
+        ys = []
+        for b in range(1,6):
+            f = os.path.join(ROOT, 'data_batch_%d' % (b, ))
+            X, Y = _load_CIFAR_batch_raw(f)
+            xs.append(X)
+            ys.append(Y)
+        Xtr = np.concatenate(xs)
+        Ytr = np.concatenate(ys)
+        del X, Y
+        Xte, Yte = _load_CIFAR_batch_raw(os.path.join(ROOT, 'test_batch'))
+    Xtr = _CIFAR_images(Xtr, layout, dtype)
+    Xte = _CIFAR_images(Xte, layout, dtype)
+    return Xtr, Ytr, Xte, Yte
+
+
+def cache_CIFAR10(ROOT):
+    """
+    Convert the pickled CIFAR-10 batches in ROOT into a compact cache of .npy
+    files that load_CIFAR10 can memory-map. This only needs to be run once;
+    load_CIFAR10(ROOT, cache=True) calls it automatically if the cache is
+    missing.
+
+    Images are stored as raw uint8 of shape (N, 3, 32, 32), exactly as they
+    appear in the batch files, and labels as int64 of shape (N,), in
+    ROOT/npy_cache/{X_train, y_train, X_test, y_test}.npy.
+    Each file is written under a temporary name and renamed into place so
+    that concurrent readers never see a partially written cache.
+
+    Inputs:
+    - ROOT: String giving the path to the cifar-10-batches-py directory.
+
+    Returns:
+    - cache_dir: String giving the path to the cache directory.
+    """
+    cache_dir = os.path.join(ROOT, CIFAR10_CACHE_DIR)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+
     xs = []
     ys = []
     for b in range(1,6):
         f = os.path.join(ROOT, 'data_batch_%d' % (b, ))
-        X, Y = load_CIFAR_batch(f)
+        X, Y = _load_CIFAR_batch_raw(f)
         xs.append(X)
         ys.append(Y)
-    Xtr = np.concatenate(xs)
-    Ytr = np.concatenate(ys)
-    del X, Y
-    Xte, Yte = load_CIFAR_batch(os.path.join(ROOT, 'test_batch'))
-    return Xtr, Ytr, Xte, Yte
+    Xte, Yte = _load_CIFAR_batch_raw(os.path.join(ROOT, 'test_batch'))
+    arrays = (np.concatenate(xs), np.concatenate(ys), Xte, Yte)
+
+    for name, arr in zip(CIFAR10_CACHE_FILES, arrays):
+        path = os.path.join(cache_dir, '%s.npy' % name)
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            np.save(f, np.ascontiguousarray(arr))
+        os.rename(tmp_path, path)
+    return cache_dir
 
 
 def get_CIFAR10_data(num_training=49000, num_validation=1000, num_test=1000,
-                     subtract_mean=True):
+                     subtract_mean=True, layout='NCHW', dtype=np.float64,
+                     cache=False):
     """
     Load the CIFAR-10 dataset from disk and perform preprocessing to prepare
     it for classifiers. These are the same steps as we used for the SVM, but
     condensed to a single function.
+
+    The images are converted to the requested layout and dtype exactly once;
+    X_train and X_val are slice views into that single array and the mean
+    image is subtracted in place, one chunk at a time.
+
+    Inputs:
+    - num_training, num_validation, num_test: Sizes of the splits.
+    - subtract_mean: Whether to subtract the mean training image. This needs
+      a floating point dtype.
+    - layout: Either 'NCHW' (the default) or 'NHWC'.
+    - dtype: numpy datatype of the returned images, e.g. np.float32 or
+      np.uint8.
+    - cache: Whether to load the data through the memory-mapped cache; see
+      load_CIFAR10.
     """
+    if subtract_mean and not np.issubdtype(dtype, np.floating):
+        raise ValueError('subtract_mean needs a floating point dtype')
+
     # Load the raw CIFAR-10 data
     cifar10_dir = 'cs231n/datasets/cifar-10-batches-py'
-    X_train, y_train, X_test, y_test = load_CIFAR10(cifar10_dir)
+    X_train, y_train, X_test, y_test = load_CIFAR10(cifar10_dir, cache=cache,
+                                                    layout=layout, dtype=dtype)
 
     # Subsample the data
-    mask = list(range(num_training, num_training + num_validation))
-    X_val = X_train[mask]
-    y_val = y_train[mask]
-    mask = list(range(num_training))
-    X_train = X_train[mask]
-    y_train = y_train[mask]
-    mask = list(range(num_test))
-    X_test = X_test[mask]
-    y_test = y_test[mask]
+    X_val = X_train[num_training:num_training + num_validation]
+    y_val = y_train[num_training:num_training + num_validation]
+    X_train = X_train[:num_training]
+    y_train = y_train[:num_training]
+    X_test = X_test[:num_test]
+    y_test = y_test[:num_test]
 
     # Normalize the data: subtract the mean image
     if subtract_mean:
         mean_image = np.mean(X_train, axis=0)
-        X_train -= mean_image
-        X_val -= mean_image
-        X_test -= mean_image
-
-    # Transpose so that channels come first
-    X_train = X_train.transpose(0, 3, 1, 2).copy()
-    X_val = X_val.transpose(0, 3, 1, 2).copy()
-    X_test = X_test.transpose(0, 3, 1, 2).copy()
+        _subtract_mean(X_train, mean_image)
+        _subtract_mean(X_val, mean_image)
+        _subtract_mean(X_test, mean_image)
 
     # Package data into a dictionary
     return {
@@ -83,7 +185,93 @@ def get_CIFAR10_data(num_training=49000, num_validation=1000, num_test=1000,
     }
 
 
-def load_tiny_imagenet(path, dtype=np.float32, subtract_mean=True):
+def _subtract_mean(X, mean_image, chunk_size=1000):
+    """ subtract mean_image from X in place, chunk_size images at a time """
+    for start in range(0, X.shape[0], chunk_size):
+        X[start:start + chunk_size] -= mean_image
+
+
+def _read_tiny_image(filename):
+    """ read one 64x64 TinyImageNet image as an array of shape (C, 64, 64) """
+    img = imread(filename)
+    if img.ndim == 2:
+        ## grayscale file
+        img.shape = (64, 64, 1)
+    return img.transpose(2, 0, 1)
+
+
+# Output array of the current decoding worker process; see
+# _init_tiny_imagenet_worker.
+_tiny_imagenet_worker = {}
+
+
+def _init_tiny_imagenet_worker(buf, dtype, shape):
+    _tiny_imagenet_worker['X'] = np.frombuffer(buf, dtype=dtype).reshape(shape)
+
+
+def _decode_tiny_imagenet_chunk(chunk):
+    X = _tiny_imagenet_worker['X']
+    for i, filename in chunk:
+        X[i] = _read_tiny_image(filename)
+    return len(chunk)
+
+
+def _decode_tiny_imagenet(filenames, dtype, num_workers=0, chunk_size=250):
+    """
+    Decode a list of TinyImageNet image files into one array.
+
+    With num_workers > 0 the files are split into chunks that are decoded by
+    a pool of worker processes. The output array lives in shared memory and
+    is preallocated by the parent, so each worker writes its images straight
+    into their final position and nothing is pickled back.
+
+    Inputs:
+    - filenames: List of N paths to image files.
+    - dtype: numpy datatype of the output.
+    - num_workers: Number of worker processes; 0 decodes in this process and
+      None uses one worker per CPU.
+    - chunk_size: Number of images handed to a worker at a time.
+
+    Returns:
+    - X: Array of shape (N, 3, 64, 64).
+    """
+    if num_workers is None:
+        num_workers = multiprocessing.cpu_count()
+    num_images = len(filenames)
+    shape = (num_images, 3, 64, 64)
+    print_every = max(num_images // 10, 1)
+
+    if num_workers == 0:
+        X = np.zeros(shape, dtype=dtype)
+        for i, filename in enumerate(filenames):
+            if (i + 1) % print_every == 0:
+                print('decoded %d / %d images' % (i + 1, num_images))
+            X[i] = _read_tiny_image(filename)
+        return X
+
+    dtype = np.dtype(dtype)
+    nbytes = num_images * 3 * 64 * 64 * dtype.itemsize
+    buf = multiprocessing.RawArray('b', nbytes)
+    tasks = list(enumerate(filenames))
+    chunks = [tasks[i:i + chunk_size] for i in range(0, num_images, chunk_size)]
+    pool = multiprocessing.Pool(num_workers, _init_tiny_imagenet_worker,
+                                (buf, dtype.str, shape))
+    try:
+        num_done = 0
+        for n in pool.imap_unordered(_decode_tiny_imagenet_chunk, chunks):
+            if (num_done + n) // print_every > num_done // print_every:
+                print('decoded %d / %d images' % (num_done + n, num_images))
+            num_done += n
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+    return np.frombuffer(buf, dtype=dtype).reshape(shape)
+
+
+def load_tiny_imagenet(path, dtype=np.float32, subtract_mean=True,
+                       num_workers=0, shard_dir=None, classes=None,
+                       splits=('train', 'val', 'test'), lazy=False):
     """
     Load TinyImageNet. Each of TinyImageNet-100-A, TinyImageNet-100-B, and
     TinyImageNet-200 have the same directory structure, so this can be used
@@ -93,6 +281,24 @@ def load_tiny_imagenet(path, dtype=np.float32, subtract_mean=True):
     - path: String giving path to the directory to load.
     - dtype: numpy datatype used to load the data.
     - subtract_mean: Whether to subtract the mean training image.
+    - num_workers: Number of processes used to decode the images. The default
+      of 0 decodes them one at a time in this process; None uses one worker
+      per CPU.
+    - shard_dir: If not None, load the dataset from the packed uint8 shards
+      in this directory, writing them with pack_tiny_imagenet first if they
+      do not exist yet. Only the shards that are asked for are read, and
+      they are memory-mapped rather than decoded.
+    - classes: Only used with shard_dir. None loads every class, an integer
+      k loads the first k classes and a list of wnids loads those classes.
+      Labels are renumbered 0 ... K - 1 in the order of the chosen classes.
+      When test labels are not available X_test is not filtered by class.
+      Images of each split come grouped by class when loading from shards.
+    - lazy: Only used with shard_dir. If True, X_train, X_val and X_test are
+      Dataset objects over the memory-mapped shards instead of arrays, and
+      images are only read, converted to dtype and mean-subtracted when a
+      batch of them is taken.
+    - splits: Only used with shard_dir. The subset of 'train', 'val' and
+      'test' to load; the entries for the other splits will be None.
 
     Returns: A dictionary with the following entries:
     - class_names: A list where class_names[i] is a list of strings giving the
@@ -106,6 +312,14 @@ def load_tiny_imagenet(path, dtype=np.float32, subtract_mean=True):
       (such as in student code) then y_test will be None.
     - mean_image: (3, 64, 64) array giving mean training image
     """
+    if shard_dir is not None:
+        if not os.path.isfile(os.path.join(shard_dir, 'index.json')):
+            pack_tiny_imagenet(path, shard_dir, num_workers=num_workers)
+        return _load_tiny_imagenet_shards(shard_dir, dtype, subtract_mean,
+                                          classes, splits, lazy)
+    if classes is not None or tuple(splits) != ('train', 'val', 'test'):
+        raise ValueError('classes and splits can only be used with shard_dir')
+
     # First load wnids
     with open(os.path.join(path, 'wnids.txt'), 'r') as f:
         wnids = [x.strip() for x in f]
@@ -120,65 +334,36 @@ def load_tiny_imagenet(path, dtype=np.float32, subtract_mean=True):
             wnid_to_words[wnid] = [w.strip() for w in words.split(',')]
     class_names = [wnid_to_words[wnid] for wnid in wnids]
 
-    # Next load training data.
-    X_train = []
+    # Next find the training images.
+    train_files = []
     y_train = []
-    for i, wnid in enumerate(wnids):
-        if (i + 1) % 20 == 0:
-            print('loading training data for synset %d / %d'
-                  % (i + 1, len(wnids)))
+    for wnid in wnids:
         # To figure out the filenames we need to open the boxes file
         boxes_file = os.path.join(path, 'train', wnid, '%s_boxes.txt' % wnid)
         with open(boxes_file, 'r') as f:
             filenames = [x.split('\t')[0] for x in f]
-        num_images = len(filenames)
-
-        X_train_block = np.zeros((num_images, 3, 64, 64), dtype=dtype)
-        y_train_block = wnid_to_label[wnid] * \
-                        np.ones(num_images, dtype=np.int64)
-        for j, img_file in enumerate(filenames):
-            img_file = os.path.join(path, 'train', wnid, 'images', img_file)
-            img = imread(img_file)
-            if img.ndim == 2:
-        ## grayscale file
-                img.shape = (64, 64, 1)
-            X_train_block[j] = img.transpose(2, 0, 1)
-        X_train.append(X_train_block)
-        y_train.append(y_train_block)
-
-    # We need to concatenate all training data
-    X_train = np.concatenate(X_train, axis=0)
+        train_files.extend(os.path.join(path, 'train', wnid, 'images', img_file)
+                           for img_file in filenames)
+        y_train.append(wnid_to_label[wnid] *
+                       np.ones(len(filenames), dtype=np.int64))
     y_train = np.concatenate(y_train, axis=0)
 
-    # Next load validation data
+    # Next find the validation images
     with open(os.path.join(path, 'val', 'val_annotations.txt'), 'r') as f:
-        img_files = []
+        val_files = []
         val_wnids = []
         for line in f:
             img_file, wnid = line.split('\t')[:2]
-            img_files.append(img_file)
+            val_files.append(os.path.join(path, 'val', 'images', img_file))
             val_wnids.append(wnid)
-        num_val = len(img_files)
         y_val = np.array([wnid_to_label[wnid] for wnid in val_wnids])
-        X_val = np.zeros((num_val, 3, 64, 64), dtype=dtype)
-        for i, img_file in enumerate(img_files):
-            img_file = os.path.join(path, 'val', 'images', img_file)
-            img = imread(img_file)
-            if img.ndim == 2:
-                img.shape = (64, 64, 1)
-            X_val[i] = img.transpose(2, 0, 1)
-
-    # Next load test images
+
+    # Next find the test images
     # Students won't have test labels, so we need to iterate over files in the
     # images directory.
     img_files = os.listdir(os.path.join(path, 'test', 'images'))
-    X_test = np.zeros((len(img_files), 3, 64, 64), dtype=dtype)
-    for i, img_file in enumerate(img_files):
-        img_file = os.path.join(path, 'test', 'images', img_file)
-        img = imread(img_file)
-        if img.ndim == 2:
-            img.shape = (64, 64, 1)
-        X_test[i] = img.transpose(2, 0, 1)
+    test_files = [os.path.join(path, 'test', 'images', img_file)
+                  for img_file in img_files]
 
     y_test = None
     y_test_file = os.path.join(path, 'test', 'test_annotations.txt')
@@ -192,6 +377,14 @@ def load_tiny_imagenet(path, dtype=np.float32, subtract_mean=True):
                   for img_file in img_files]
         y_test = np.array(y_test)
 
+    # Decode all three splits into one array and hand out views of it
+    X = _decode_tiny_imagenet(train_files + val_files + test_files, dtype,
+                              num_workers=num_workers)
+    num_train, num_val = len(train_files), len(val_files)
+    X_train = X[:num_train]
+    X_val = X[num_train:num_train + num_val]
+    X_test = X[num_train + num_val:]
+
     mean_image = X_train.mean(axis=0)
     if subtract_mean:
         X_train -= mean_image[None]
@@ -211,27 +404,333 @@ def load_tiny_imagenet(path, dtype=np.float32, subtract_mean=True):
     }
 
 
-def load_models(models_dir):
+def pack_tiny_imagenet(path, shard_dir, num_workers=0):
+    """
+    Decode TinyImageNet once and store it in shard_dir as packed uint8 shards
+    that load_tiny_imagenet can memory-map on later runs.
+
+    The directory holds one (n, 3, 64, 64) uint8 .npy file per synset and
+    split (train_<wnid>.npy and val_<wnid>.npy), test.npy with the test
+    images (plus test_labels.npy if test labels are available), the mean
+    training image in mean_image.npy, and a label index in index.json giving
+    the wnids, class names and number of images in each shard. index.json is
+    written last, so a directory without it is an incomplete pack.
+
+    Inputs:
+    - path: String giving path to the TinyImageNet directory.
+    - shard_dir: String giving the directory to write the shards to.
+    - num_workers: Number of processes used to decode the images; see
+      load_tiny_imagenet.
+    """
+    data = load_tiny_imagenet(path, dtype=np.uint8, subtract_mean=False,
+                              num_workers=num_workers)
+    with open(os.path.join(path, 'wnids.txt'), 'r') as f:
+        wnids = [x.strip() for x in f]
+    if not os.path.isdir(shard_dir):
+        os.makedirs(shard_dir)
+
+    index = {
+      'wnids': wnids,
+      'class_names': data['class_names'],
+      'train': {},
+      'val': {},
+      'test': int(data['X_test'].shape[0]),
+      'has_test_labels': data['y_test'] is not None,
+    }
+    for split in ('train', 'val'):
+        X, y = data['X_%s' % split], data['y_%s' % split]
+        order = np.argsort(y, kind='mergesort')
+        bounds = np.searchsorted(y[order], np.arange(len(wnids) + 1))
+        for i, wnid in enumerate(wnids):
+            shard = X[order[bounds[i]:bounds[i + 1]]]
+            np.save(os.path.join(shard_dir, '%s_%s.npy' % (split, wnid)), shard)
+            index[split][wnid] = int(shard.shape[0])
+    np.save(os.path.join(shard_dir, 'test.npy'), data['X_test'])
+    if data['y_test'] is not None:
+        np.save(os.path.join(shard_dir, 'test_labels.npy'), data['y_test'])
+    np.save(os.path.join(shard_dir, 'mean_image.npy'), data['mean_image'])
+
+    with open(os.path.join(shard_dir, 'index.json'), 'w') as f:
+        json.dump(index, f)
+
+
+def _load_tiny_imagenet_shards(shard_dir, dtype, subtract_mean, classes,
+                               splits, lazy):
+    """ load_tiny_imagenet from the shards written by pack_tiny_imagenet """
+    with open(os.path.join(shard_dir, 'index.json'), 'r') as f:
+        index = json.load(f)
+    all_wnids = index['wnids']
+    if classes is None:
+        wnids = all_wnids
+    elif isinstance(classes, int):
+        wnids = all_wnids[:classes]
+    else:
+        wnids = list(classes)
+    wnid_to_label = {wnid: i for i, wnid in enumerate(wnids)}
+    for split in splits:
+        if split not in ('train', 'val', 'test'):
+            raise ValueError('Invalid split "%s"' % split)
+
+    def load_shard(name):
+        return np.load(os.path.join(shard_dir, name), mmap_mode='r')
+
+    shards = {}
+    data = {
+      'class_names': [index['class_names'][all_wnids.index(wnid)]
+                      for wnid in wnids],
+      'y_train': None, 'y_val': None, 'y_test': None,
+    }
+    for split in ('train', 'val'):
+        if split not in splits:
+            continue
+        counts = [index[split][wnid] for wnid in wnids]
+        shards[split] = [load_shard('%s_%s.npy' % (split, wnid))
+                         for wnid in wnids]
+        data['y_%s' % split] = np.repeat(np.arange(len(wnids)), counts)
+    if 'test' in splits:
+        X_test = load_shard('test.npy')
+        if index['has_test_labels']:
+            label_map = np.array([wnid_to_label.get(wnid, -1)
+                                  for wnid in all_wnids])
+            y_test = label_map[load_shard('test_labels.npy')]
+            keep = np.flatnonzero(y_test >= 0)
+            data['y_test'] = y_test[keep]
+            X_test = X_test[keep]
+        shards['test'] = [X_test]
+
+    if classes is None or 'train' not in shards:
+        mean_image = np.load(os.path.join(shard_dir, 'mean_image.npy'))
+    else:
+        mean_image = Dataset(shards['train']).mean()
+
+    for split in ('train', 'val', 'test'):
+        X = None
+        if split in shards and lazy:
+            X = Dataset(shards[split], dtype=dtype,
+                        mean_image=mean_image if subtract_mean else None)
+        elif split in shards:
+            num_images = sum(shard.shape[0] for shard in shards[split])
+            X = np.empty((num_images, 3, 64, 64), dtype=dtype)
+            start = 0
+            for shard in shards[split]:
+                X[start:start + shard.shape[0]] = shard
+                start += shard.shape[0]
+            if subtract_mean:
+                X -= mean_image[None]
+        data['X_%s' % split] = X
+    data['mean_image'] = mean_image
+    return data
+
+
+class Dataset(object):
+    """
+    A dataset of images that is read lazily from one or more shards, which
+    are usually read-only memory maps of uint8 .npy files. The shards are
+    concatenated along their first axis, but nothing is read until a batch
+    of images is taken; each batch is then converted to dtype and has the
+    mean image subtracted on the way into its output buffer. This means a
+    Dataset can be much larger than RAM.
+
+    A Dataset supports enough of the numpy array interface to stand in for
+    the X_train and X_val arrays given to a Solver: shape, dtype, len(),
+    take(indices, axis=0, out=None) and indexing with an integer, a slice or
+    an integer array.
+
+    Example usage:
+
+    shards = [np.load(f, mmap_mode='r') for f in shard_files]
+    X_train = Dataset(shards, dtype=np.float32)
+    X_train.mean_image = X_train.mean()
+    X_batch = X_train.take(np.random.choice(len(X_train), 100))
+    """
+
+    def __init__(self, shards, dtype=np.float32, mean_image=None):
+        """
+        Inputs:
+        - shards: List of arrays of shape (N_i, d_1, ..., d_k) with the same
+          trailing dimensions.
+        - dtype: numpy datatype of the batches that are taken.
+        - mean_image: If not None, an array of shape (d_1, ..., d_k) that is
+          subtracted from every image that is taken.
+        """
+        self.shards = list(shards)
+        self.dtype = np.dtype(dtype)
+        self.mean_image = mean_image
+        sizes = [shard.shape[0] for shard in self.shards]
+        self.offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+        self.shape = (int(self.offsets[-1]),) + tuple(self.shards[0].shape[1:])
+        self.ndim = len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.take(np.arange(*index.indices(len(self))))
+        if np.ndim(index) == 0:
+            return self.take([index])[0]
+        return self.take(index)
+
+    def take(self, indices, axis=0, out=None):
+        """
+        Gather a batch of images.
+
+        The indices are sorted before they are looked up so that each shard
+        is read front to back, and each shard is read with a single
+        vectorized gather.
+
+        Inputs:
+        - indices: Integer array of shape (B,) of images to take.
+        - axis: Must be 0; present for compatibility with ndarray.take.
+        - out: If not None, an array of shape (B, d_1, ..., d_k) and dtype
+          self.dtype to write the batch into.
+
+        Returns:
+        - out: Array of shape (B, d_1, ..., d_k) holding the batch.
+        """
+        if axis != 0:
+            raise ValueError('Dataset.take only supports axis=0')
+        indices = np.asarray(indices, dtype=np.int64)
+        if indices.size and (indices.min() < 0 or indices.max() >= len(self)):
+            raise IndexError('Dataset index out of range')
+        if out is None:
+            out = np.empty(indices.shape + self.shape[1:], dtype=self.dtype)
+
+        order = np.argsort(indices, kind='mergesort')
+        sorted_indices = indices[order]
+        bounds = np.searchsorted(sorted_indices, self.offsets)
+        for i, shard in enumerate(self.shards):
+            lo, hi = bounds[i], bounds[i + 1]
+            if lo < hi:
+                local = sorted_indices[lo:hi] - self.offsets[i]
+                out[order[lo:hi]] = shard[local]
+        if self.mean_image is not None:
+            out -= self.mean_image
+        return out
+
+    def mean(self, chunk_size=1000):
+        """
+        Compute the mean image of the raw shards, chunk_size images at a time.
+        """
+        total = np.zeros(self.shape[1:])
+        for shard in self.shards:
+            for start in range(0, shard.shape[0], chunk_size):
+                total += np.sum(shard[start:start + chunk_size], axis=0,
+                                dtype=np.float64)
+        return total / max(len(self), 1)
+
+
+def _pickle_protocol(filename):
+    """
+    Guess from its first two bytes and its last byte whether filename holds
+    a pickle, without unpickling it. Returns the pickle protocol, or None if
+    it is not a pickle.
+    """
+    with open(filename, 'rb') as f:
+        header = bytearray(f.read(2))
+        if len(header) < 2:
+            return None
+        f.seek(-1, os.SEEK_END)
+        last = f.read(1)
+    if last != b'.':
+        # Every pickle ends with the STOP opcode
+        return None
+    if header[0] == 0x80:
+        # PROTO opcode, which starts every pickle of protocol 2 and above
+        return header[1] if 2 <= header[1] <= 5 else None
+    if header[0] in bytearray(b'}]'):
+        # EMPTY_DICT and EMPTY_LIST start a protocol 1 dict or list
+        return 1
+    if header[0:2] in (bytearray(b'(d'), bytearray(b'(l')):
+        # MARK followed by DICT or LIST starts a protocol 0 dict or list
+        return 0
+    return None
+
+
+class ModelIndex(Mapping):
+    """
+    A read-only mapping from model file names to models, as returned by
+    load_models.
+
+    Building the index only reads the first bytes and the stat of each file,
+    so it is cheap even for directories with hundreds of checkpoints. A model
+    is unpickled the first time it is looked up and then kept in an LRU
+    cache; once the cache holds more than max_cache_bytes worth of models
+    the least recently used ones are dropped and reloaded on their next
+    access. The size of a model is taken to be the size of its file.
+
+    The metadata gathered for each file is available as index.info[name], a
+    dictionary with keys 'path', 'size', 'mtime' and 'protocol'.
+    """
+
+    def __init__(self, models_dir, max_cache_bytes=None):
+        """
+        Inputs:
+        - models_dir: String giving the path to a directory of model files.
+        - max_cache_bytes: Total file size of the models to keep in memory;
+          None keeps every model that has been loaded.
+        """
+        self.models_dir = models_dir
+        self.max_cache_bytes = max_cache_bytes
+        self.info = {}
+        for model_file in sorted(os.listdir(models_dir)):
+            path = os.path.join(models_dir, model_file)
+            if not os.path.isfile(path):
+                continue
+            protocol = _pickle_protocol(path)
+            if protocol is None:
+                continue
+            stat = os.stat(path)
+            self.info[model_file] = {
+              'path': path,
+              'size': stat.st_size,
+              'mtime': stat.st_mtime,
+              'protocol': protocol,
+            }
+        self._cache = OrderedDict()
+        self._cache_bytes = 0
+
+    def __getitem__(self, model_file):
+        if model_file in self._cache:
+            # Move to the most recently used end
+            model = self._cache.pop(model_file)
+            self._cache[model_file] = model
+            return model
+
+        info = self.info[model_file]
+        with open(info['path'], 'rb') as f:
+            model = load_pickle(f)['model']
+        self._cache[model_file] = model
+        self._cache_bytes += info['size']
+        while (self.max_cache_bytes is not None and len(self._cache) > 1 and
+               self._cache_bytes > self.max_cache_bytes):
+            evicted, _ = self._cache.popitem(last=False)
+            self._cache_bytes -= self.info[evicted]['size']
+        return model
+
+    def __iter__(self):
+        return iter(sorted(self.info))
+
+    def __len__(self):
+        return len(self.info)
+
+
+def load_models(models_dir, max_cache_bytes=None):
     """
-    Load saved models from disk. This will attempt to unpickle all files in a
-    directory; any files that give errors on unpickling (such as README.txt)
-    will be skipped.
+    Load saved models from disk. Files are recognized as models by their
+    pickle header, so files such as README.txt are skipped without being
+    read; the models themselves are only unpickled when they are looked up.
 
     Inputs:
     - models_dir: String giving the path to a directory containing model files.
       Each model file is a pickled dictionary with a 'model' field.
+    - max_cache_bytes: If not None, bound the memory used by loaded models;
+      see ModelIndex.
 
     Returns:
-    A dictionary mapping model file names to models.
+    A ModelIndex, which is a mapping from model file names to models.
     """
-    models = {}
-    for model_file in os.listdir(models_dir):
-        with open(os.path.join(models_dir, model_file), 'rb') as f:
-            try:
-                models[model_file] = load_pickle(f)['model']
-            except pickle.UnpicklingError:
-                continue
-    return models
+    return ModelIndex(models_dir, max_cache_bytes=max_cache_bytes)
 
 
 def load_imagenet_val(num=None):
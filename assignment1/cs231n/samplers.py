@@ -0,0 +1,169 @@
+from builtins import range
+from builtins import object
+import numpy as np
+
+"""
+This file implements minibatch samplers for the training loops. A sampler is
+an iterable that yields, forever, the indices of one minibatch of training
+data at a time. The indices are either an integer array or a slice; in both
+cases X[indices] and y[indices] give the minibatch.
+
+Every sampler draws its randomness from a RandomState seeded with seed, or
+from the global numpy random state if seed is None.
+"""
+
+
+class Sampler(object):
+    """
+    Base class for samplers.
+    """
+
+    def __init__(self, num_train, batch_size, seed=None):
+        """
+        Inputs:
+        - num_train: Number of training examples.
+        - batch_size: Number of examples in each minibatch.
+        - seed: Optional seed for the random state of the sampler.
+        """
+        self.num_train = num_train
+        self.batch_size = batch_size
+        self.rng = np.random if seed is None else np.random.RandomState(seed)
+
+    def __iter__(self):
+        raise NotImplementedError
+
+
+class RandomSampler(Sampler):
+    """
+    Draws every minibatch independently, with replacement. This is what the
+    training loops have always done, but it does not guarantee that every
+    example is visited during an epoch.
+    """
+
+    def __iter__(self):
+        while True:
+            yield self.rng.choice(self.num_train, self.batch_size)
+
+
+class PermutationSampler(Sampler):
+    """
+    Visits the examples in a fresh random order each epoch. The orders of
+    consecutive epochs are concatenated into one stream that is cut into
+    minibatches, so every minibatch is full and every example is visited
+    once every num_train examples.
+    """
+
+    def _order(self):
+        return self.rng.permutation(self.num_train)
+
+    def __iter__(self):
+        order, pos = self._order(), 0
+        batch_size = min(self.batch_size, self.num_train)
+        while True:
+            parts, needed = [], batch_size
+            while needed > 0:
+                if pos == len(order):
+                    order, pos = self._order(), 0
+                n = min(needed, len(order) - pos)
+                parts.append(order[pos:pos + n])
+                pos += n
+                needed -= n
+            yield parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+
+class StratifiedSampler(PermutationSampler):
+    """
+    Like PermutationSampler, but the order of each epoch spreads every class
+    evenly over the epoch, so each minibatch holds about the same fraction
+    of each class as the whole training set.
+    """
+
+    def __init__(self, y, batch_size, seed=None):
+        """
+        Inputs:
+        - y: Array of shape (N,) giving the integer label of each example.
+        - batch_size, seed: As for Sampler.
+        """
+        super(StratifiedSampler, self).__init__(y.shape[0], batch_size, seed)
+        self.y = np.asarray(y)
+
+    def _order(self):
+        # Shuffle, then stably sort by class, to get a random order within
+        # each class.
+        perm = self.rng.permutation(self.num_train)
+        perm = perm[np.argsort(self.y[perm], kind='mergesort')]
+        y = self.y[perm]
+
+        # Give the k-th of the n_c examples of class c the position
+        # (k + phase_c) / n_c in the epoch, with a random phase per class,
+        # and visit the examples in order of position.
+        counts = np.bincount(y)
+        starts = np.cumsum(counts) - counts
+        rank = np.arange(self.num_train) - starts[y]
+        phase = self.rng.rand(len(counts))
+        position = (rank + phase[y]) / counts[y]
+        return perm[np.argsort(position, kind='mergesort')]
+
+
+class ContiguousSampler(Sampler):
+    """
+    Shuffles the training arrays themselves, in place, at the start of every
+    epoch and then yields consecutive slices of them. Minibatches are then
+    views of contiguous memory rather than random gathers. The last
+    num_train % batch_size examples of each shuffled epoch are skipped.
+
+    The arrays are modified, so they must be writeable numpy arrays and must
+    not be read by anything else while an epoch is being shuffled.
+    """
+
+    def __init__(self, arrays, batch_size, seed=None):
+        """
+        Inputs:
+        - arrays: List of arrays with the same first dimension, such as
+          [X, y]; they are all shuffled with the same permutation.
+        - batch_size, seed: As for Sampler.
+        """
+        super(ContiguousSampler, self).__init__(arrays[0].shape[0],
+                                                batch_size, seed)
+        for arr in arrays:
+            if not isinstance(arr, np.ndarray) or not arr.flags.writeable:
+                raise ValueError('ContiguousSampler needs writeable arrays')
+        self.arrays = arrays
+
+    def __iter__(self):
+        batch_size = min(self.batch_size, self.num_train)
+        while True:
+            state = self.rng.get_state()
+            for arr in self.arrays:
+                self.rng.set_state(state)
+                self.rng.shuffle(arr)
+            for start in range(0, self.num_train - batch_size + 1, batch_size):
+                yield slice(start, start + batch_size)
+
+
+def get_sampler(sampler, X, y, batch_size, seed=None):
+    """
+    Build a sampler for a training loop.
+
+    Inputs:
+    - sampler: Either a Sampler, which is returned as is, or one of the
+      strings 'random', 'permutation', 'stratified' or 'contiguous'.
+    - X: Training data, of shape (N, d_1, ..., d_k).
+    - y: Training labels, of shape (N,).
+    - batch_size: Number of examples in each minibatch.
+    - seed: Optional seed for the random state of the sampler.
+
+    Returns:
+    - A Sampler.
+    """
+    if isinstance(sampler, Sampler):
+        return sampler
+    if sampler == 'random':
+        return RandomSampler(X.shape[0], batch_size, seed)
+    if sampler == 'permutation':
+        return PermutationSampler(X.shape[0], batch_size, seed)
+    if sampler == 'stratified':
+        return StratifiedSampler(y, batch_size, seed)
+    if sampler == 'contiguous':
+        return ContiguousSampler([X, y], batch_size, seed)
+    raise ValueError('Invalid sampler "%s"' % sampler)
@@ -0,0 +1,111 @@
+from builtins import object
+import numpy as np
+
+
+class BatchAugmenter(object):
+    """
+    A BatchAugmenter applies random data augmentation to a whole minibatch of
+    images of shape (N, C, H, W) at once: random crops from a zero-padded
+    copy of each image, random horizontal flips, and random brightness,
+    contrast and saturation jitter. Each image gets its own random crop
+    offset, flip and jitter factors, but all of them are drawn and applied
+    with vectorized operations over the batch rather than per-image loops.
+
+    The augmenter draws from its own RandomState, so give every worker that
+    augments batches concurrently its own augmenter. A Solver uses it either
+    inline in _step or on its prefetch thread; see the augment option of
+    Solver.
+
+    Example usage:
+
+    augment = BatchAugmenter(crop_pad=4, flip=True, brightness=10.0, seed=0)
+    X_batch = augment(X_batch)
+    """
+
+    def __init__(self, crop_pad=4, flip=True, brightness=0.0, contrast=0.0,
+                 saturation=0.0, seed=None):
+        """
+        Inputs:
+        - crop_pad: Number of pixels of zero padding on each side of an image
+          before cropping it back to its original size at a random offset;
+          0 disables cropping.
+        - flip: Whether to flip half of the images horizontally.
+        - brightness: Each image is shifted by a random value drawn uniformly
+          from [-brightness, brightness], in the units of the data.
+        - contrast: The deviation of each image from its mean is scaled by a
+          random factor from [1 - contrast, 1 + contrast].
+        - saturation: The deviation of each pixel from its mean over the
+          channels is scaled by a random factor from
+          [1 - saturation, 1 + saturation].
+        - seed: Seed for the random state of the augmenter. If None it is
+          seeded from the global numpy random state.
+        """
+        self.crop_pad = crop_pad
+        self.flip = flip
+        self.brightness = brightness
+        self.contrast = contrast
+        self.saturation = saturation
+        if seed is None:
+            seed = np.random.randint(2**31)
+        self.rng = np.random.RandomState(seed)
+
+    def _factors(self, N, amount, dtype):
+        return self.rng.uniform(1 - amount, 1 + amount, N).astype(dtype)
+
+    def __call__(self, X, out=None):
+        """
+        Augment a minibatch.
+
+        Inputs:
+        - X: Floating point array of shape (N, C, H, W).
+        - out: Optional array of the same shape and dtype to write the result
+          into; it may be X itself.
+
+        Returns:
+        - out: The augmented minibatch. X is left untouched unless it is out.
+        """
+        N, C, H, W = X.shape
+        p = self.crop_pad
+
+        if p > 0:
+            X_pad = np.pad(X, ((0, 0), (0, 0), (p, p), (p, p)),
+                           mode='constant')
+            sN, sC, sH, sW = X_pad.strides
+            windows = np.lib.stride_tricks.as_strided(X_pad,
+                          shape=(N, C, 2 * p + 1, 2 * p + 1, H, W),
+                          strides=(sN, sC, sH, sW, sH, sW))
+            dy = self.rng.randint(0, 2 * p + 1, N)
+            dx = self.rng.randint(0, 2 * p + 1, N)
+            cropped = windows[np.arange(N), :, dy, dx]
+            if out is None:
+                out = cropped
+            else:
+                out[...] = cropped
+        elif out is None:
+            out = X.copy()
+        elif out is not X:
+            out[...] = X
+
+        if self.flip:
+            flip = np.flatnonzero(self.rng.rand(N) < 0.5)
+            out[flip] = out[flip, :, :, ::-1]
+
+        if self.brightness > 0:
+            shift = self.rng.uniform(-self.brightness, self.brightness, N)
+            out += shift.astype(out.dtype).reshape(N, 1, 1, 1)
+
+        if self.contrast > 0:
+            factor = self._factors(N, self.contrast, out.dtype)
+            mean = out.mean(axis=(1, 2, 3), keepdims=True)
+            out -= mean
+            out *= factor.reshape(N, 1, 1, 1)
+            out += mean
+
+        if self.saturation > 0:
+            factor = self._factors(N, self.saturation, out.dtype)
+            gray = out.mean(axis=1, keepdims=True)
+            out -= gray
+            out *= factor.reshape(N, 1, 1, 1)
+            out += gray
+
+        return out
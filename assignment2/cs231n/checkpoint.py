@@ -0,0 +1,200 @@
+from __future__ import print_function
+import json
+import struct
+
+import numpy as np
+
+"""
+This file implements a weights-only checkpoint format. Instead of pickling a
+whole model object, a checkpoint stores the arrays that make up the state of
+training (model.params, the running statistics in model.bn_params and the
+arrays in the optimizer configs) contiguously in one flat binary file, next
+to a JSON header describing them. Loading memory-maps the file, so restoring
+even a large model only costs a few page mappings; the arrays are mapped
+copy-on-write, so they can be updated in place without touching the file.
+
+The file layout is:
+
+  8 bytes   MAGIC
+  8 bytes   little-endian unsigned length of the JSON header
+  n bytes   JSON header
+  padding   zeros up to the next multiple of ALIGNMENT bytes
+  data      the arrays in C order, each starting at a multiple of ALIGNMENT
+            bytes from the start of the data section
+
+The header is a dictionary with the keys:
+  - 'arrays': maps array names to {'dtype', 'shape', 'offset'}, where offset
+    is relative to the start of the data section.
+  - 'meta': an arbitrary JSON-serializable dictionary.
+"""
+
+MAGIC = b'CS231NCK'
+ALIGNMENT = 64
+
+
+def _align(n):
+    return (n + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _to_json(value):
+    """ Convert numpy scalars and arrays so that json can serialize them """
+    if isinstance(value, (np.generic, np.ndarray)):
+        return value.tolist()
+    if isinstance(value, dict):
+        return {k: _to_json(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_json(v) for v in value]
+    return value
+
+
+def save_arrays(filename, arrays, meta=None):
+    """
+    Write a dictionary of arrays and a JSON-serializable dictionary of
+    metadata to a checkpoint file.
+
+    Inputs:
+    - filename: String giving the file to write.
+    - arrays: Dictionary mapping string names to numpy arrays.
+    - meta: Dictionary of extra values to store in the header; numpy scalars
+      and arrays in it are stored as numbers and lists.
+    """
+    names = sorted(arrays)
+    header = {'arrays': {}, 'meta': _to_json(meta or {})}
+    offset = 0
+    for name in names:
+        arr = np.asarray(arrays[name])
+        header['arrays'][name] = {
+          'dtype': arr.dtype.str,
+          'shape': list(arr.shape),
+          'offset': offset,
+        }
+        offset = _align(offset + arr.nbytes)
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_start = _align(len(MAGIC) + 8 + len(header_bytes))
+
+    with open(filename, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header_bytes)))
+        f.write(header_bytes)
+        for name in names:
+            f.write(b'\0' * (data_start + header['arrays'][name]['offset']
+                             - f.tell()))
+            np.ascontiguousarray(arrays[name]).tofile(f)
+
+
+def load_arrays(filename, mmap=True):
+    """
+    Read a checkpoint file written by save_arrays.
+
+    Inputs:
+    - filename: String giving the file to read.
+    - mmap: If True the arrays are copy-on-write views onto a memory map of
+      the file; otherwise the file is read into memory.
+
+    Returns a tuple of:
+    - arrays: Dictionary mapping names to numpy arrays.
+    - meta: Dictionary of extra values stored in the header.
+    """
+    with open(filename, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('"%s" is not a checkpoint file' % filename)
+        header_len, = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(header_len).decode('utf-8'))
+        data_start = _align(len(MAGIC) + 8 + header_len)
+        if not mmap:
+            f.seek(0)
+            data = np.frombuffer(bytearray(f.read()), dtype=np.uint8)
+    if mmap:
+        data = np.memmap(filename, dtype=np.uint8, mode='c')
+
+    arrays = {}
+    for name, info in header['arrays'].items():
+        dtype = np.dtype(info['dtype'])
+        shape = tuple(info['shape'])
+        start = data_start + info['offset']
+        nbytes = dtype.itemsize * int(np.prod(shape))
+        arrays[name] = data[start:start + nbytes].view(dtype).reshape(shape)
+    return arrays, header['meta']
+
+
+def _split_state(prefix, state, arrays):
+    """
+    Store the array values of the dictionary state in arrays under
+    prefix/key, and return a dictionary of the remaining values.
+    """
+    scalars = {}
+    for k, v in state.items():
+        if isinstance(v, np.ndarray):
+            arrays['%s/%s' % (prefix, k)] = v
+        else:
+            scalars[k] = _to_json(v)
+    return scalars
+
+
+def save_checkpoint(filename, model, optim_configs=None, meta=None):
+    """
+    Save the training state of a model in the weights-only format.
+
+    Inputs:
+    - filename: String giving the file to write.
+    - model: A model whose state is stored in model.params and, for models
+      with batch normalization, model.bn_params.
+    - optim_configs: Optional dictionary mapping parameter names to the
+      config dictionaries of their update rules, as kept by the Solver.
+    - meta: Optional JSON-serializable dictionary of extra values.
+    """
+    arrays = {}
+    for k, v in model.params.items():
+        arrays['params/%s' % k] = v
+
+    bn_params = getattr(model, 'bn_params', [])
+    bn_scalars = [_split_state('bn_params/%d' % i, bn_param, arrays)
+                  for i, bn_param in enumerate(bn_params)]
+
+    optim_scalars = {}
+    for p, config in (optim_configs or {}).items():
+        optim_scalars[p] = _split_state('optim/%s' % p, config, arrays)
+
+    header_meta = {
+      'bn_params': bn_scalars,
+      'optim_configs': optim_scalars,
+      'meta': meta or {},
+    }
+    save_arrays(filename, arrays, header_meta)
+
+
+def load_checkpoint(filename, model, mmap=True):
+    """
+    Restore the training state saved by save_checkpoint into a model that
+    was constructed with the same architecture.
+
+    Inputs:
+    - filename: String giving the file to read.
+    - model: The model to restore; model.params and model.bn_params are
+      updated in place.
+    - mmap: Whether to memory-map the arrays; see load_arrays.
+
+    Returns a tuple of:
+    - optim_configs: Dictionary mapping parameter names to the restored
+      update rule configs.
+    - meta: The extra values passed to save_checkpoint.
+    """
+    arrays, header_meta = load_arrays(filename, mmap=mmap)
+
+    bn_params = getattr(model, 'bn_params', [])
+    for i, scalars in enumerate(header_meta['bn_params']):
+        bn_params[i].update(scalars)
+    optim_configs = {p: dict(scalars)
+                     for p, scalars in header_meta['optim_configs'].items()}
+
+    for name, arr in arrays.items():
+        section, rest = name.split('/', 1)
+        if section == 'params':
+            model.params[rest] = arr
+        elif section == 'bn_params':
+            i, k = rest.split('/', 1)
+            bn_params[int(i)][k] = arr
+        elif section == 'optim':
+            p, k = rest.rsplit('/', 1)
+            optim_configs[p][k] = arr
+    return optim_configs, header_meta['meta']
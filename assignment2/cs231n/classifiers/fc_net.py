@@ -1,5 +1,7 @@
 from builtins import range
 from builtins import object
+import copy
+
 import numpy as np
 
 from cs231n.layers import *
@@ -136,47 +138,104 @@ class TwoLayerNet(object):
         return loss, grads
 
 
-def affine_norm_relu_forward(x, w, b, gamma, beta, n_params, norm_type='batch_norm'):
+def affine_norm_relu_forward(x, w, b, gamma, beta, n_params, norm_type='batchnorm'):
     """
-    Convenience layer that perorms an affine transform followed by a batchnorm, followed by a ReLU
+    Convenience layer that performs an affine transform followed by a batch
+    or layer normalization, followed by a ReLU.
+
+    The three layers are fused: the output of the affine GEMM is centered,
+    normalized, scaled, shifted and rectified in place, with the variance
+    computed in one pass over the centered values. The cache only holds the
+    normalized activations, the inverse standard deviations and the ReLU
+    mask, besides the input and weights of the affine layer.
 
     Inputs:
     - x: Input to the affine layer
     - w, b: Weights for the affine layer
+    - gamma, beta: Scale and shift parameters, broadcastable to shape (D,)
+    - n_params: The bn_param dictionary of batchnorm_forward, or the
+      ln_param dictionary of layernorm_forward
+    - norm_type: 'batchnorm' or 'layernorm'
 
     Returns a tuple of:
     - out: Output from the ReLU
     - cache: Object to give to the backward pass
+    - n_params: The updated n_params
     """
-    a, fc_cache = affine_forward(x, w, b)
-    
-    if(norm_type == 'batchnorm'):
-        #print('batchnorm running')
-        a_norm, norm_cache, bn_params = batchnorm_forward(a, gamma, beta, n_params)
+    eps = n_params.get('eps', 1e-5)
+    batchnorm = norm_type == 'batchnorm'
+    x_flat = x.reshape(x.shape[0], -1)
+    a = x_flat.dot(w)
+    a += b
+    N, D = a.shape
+
+    # Statistics are per feature for batchnorm and per example for layernorm
+    axis, stat = (0, 'nd,nd->d') if batchnorm else (1, 'nd,nd->n')
+    if batchnorm and n_params['mode'] == 'test':
+        zeros = np.zeros(D, dtype=a.dtype)
+        a -= n_params.get('running_mean', zeros)
+        inv_std = 1.0 / np.sqrt(n_params.get('running_var', zeros) + eps)
     else:
-        a_norm, norm_cache = layernorm_forward(a, gamma.T, beta.T, n_params)
-    
-    out, relu_cache = relu_forward(a_norm)
-    cache = (fc_cache, relu_cache, norm_cache)
-    
+        mean = a.mean(axis=axis)
+        a -= np.expand_dims(mean, axis)
+        var = np.einsum(stat, a, a) / a.shape[axis]
+        inv_std = 1.0 / np.sqrt(var + eps)
+        if batchnorm:
+            momentum = n_params.get('momentum', 0.9)
+            zeros = np.zeros(D, dtype=a.dtype)
+            running_mean = n_params.get('running_mean', zeros)
+            running_var = n_params.get('running_var', zeros)
+            n_params['running_mean'] = (momentum * running_mean +
+                                        (1 - momentum) * mean)
+            n_params['running_var'] = (momentum * running_var +
+                                       (1 - momentum) * var)
+    inv_std = np.expand_dims(inv_std.astype(a.dtype, copy=False), axis)
+    a *= inv_std
+    x_hat = a
+
+    out = x_hat * gamma
+    out += beta
+    mask = out > 0
+    out *= mask
+
+    cache = ((x, w), mask, (x_hat, inv_std, gamma, beta, axis))
     return out, cache, n_params
 
 
 def affine_norm_relu_backward(dout, cache, norm_type='batchnorm'):
     """
-    Backward pass for the affine-relu convenience layer
+    Backward pass for the affine-norm-relu convenience layer. The norm_type
+    is recorded in the cache; the argument is only kept for compatibility.
+
+    Returns a tuple of:
+    - dx: Gradient with respect to x
+    - dw, db: Gradients of the affine weights and biases
+    - dgamma, dbeta: Gradients of gamma and beta, with their shapes
     """
-    fc_cache, relu_cache, norm_cache = cache
-    da = relu_backward(dout, relu_cache)
-    
-    if(norm_type == 'batchnorm'):
-        da_norm, dgamma, dbeta = batchnorm_backward(da, norm_cache) 
-        
-    else:
-        da_norm, dgamma, dbeta = layernorm_backward(da, norm_cache)
-        
-    dx, dw, db = affine_backward(da_norm, fc_cache)
-    return dx, dw, db, dgamma, dbeta
+    (x, w), mask, (x_hat, inv_std, gamma, beta, axis) = cache
+    N, D = x_hat.shape
+    stat = 'nd,nd->d' if axis == 0 else 'nd,nd->n'
+
+    dy = dout * mask
+    dbeta = dy.sum(axis=0)
+    dgamma = np.einsum('nd,nd->d', dy, x_hat)
+    dbeta = dbeta.reshape(beta.shape) if beta.size == D else dbeta.sum()
+    dgamma = dgamma.reshape(gamma.shape) if gamma.size == D else dgamma.sum()
+
+    # Through the normalization: with g the gradient of x_hat,
+    # da = inv_std * (g - mean(g) - x_hat * mean(g * x_hat))
+    da = dy
+    da *= gamma
+    g_x_hat = np.einsum(stat, da, x_hat) / x_hat.shape[axis]
+    da -= da.mean(axis=axis, keepdims=True)
+    da -= x_hat * np.expand_dims(g_x_hat, axis)
+    da *= inv_std
+
+    x_flat = x.reshape(x.shape[0], -1)
+    dx = da.dot(w.T).reshape(x.shape)
+    dw = x_flat.T.dot(da)
+    db = da.sum(axis=0)
+    return dx, dw, db, np.asarray(dgamma), np.asarray(dbeta)
 
 
 class FullyConnectedNet(object):
@@ -470,3 +529,38 @@ class FullyConnectedNet(object):
         ############################################################################
 
         return loss, grads
+
+
+    def fold_batchnorm(self):
+        """
+        Build an inference copy of the network in which every batch
+        normalization layer is folded into the affine layer before it, using
+        the running statistics in self.bn_params. The copy has no
+        normalization layers, gives the same test-time scores as this network
+        up to rounding, and shares no parameter arrays with it.
+
+        Returns:
+        - model: A FullyConnectedNet with normalization=None.
+        """
+        if self.normalization not in (None, 'batchnorm'):
+            raise ValueError('Cannot fold normalization "%s"'
+                             % self.normalization)
+
+        model = copy.copy(self)
+        model.params = {k: v.copy() for k, v in self.params.items()
+                        if not k.startswith(('gamma', 'beta'))}
+        model.dropout_param = dict(self.dropout_param)
+        model.bn_params = []
+        model.normalization = None
+
+        if self.normalization == 'batchnorm':
+            for i, bn_param in enumerate(self.bn_params):
+                layer = str(i + 1)
+                w, b = fold_batchnorm_affine(self.params['W' + layer],
+                                             self.params['b' + layer],
+                                             self.params['gamma' + layer],
+                                             self.params['beta' + layer],
+                                             bn_param)
+                model.params['W' + layer] = w
+                model.params['b' + layer] = b
+        return model
@@ -1,27 +1,54 @@
 from __future__ import print_function
+import json
+import os
+import time
+import weakref
+from collections import OrderedDict
+
 import numpy as np
-import torch
-import torch.nn as nn
 try:
-    from cs231n.im2col_cython import col2im_cython, im2col_cython
-    from cs231n.im2col_cython import col2im_6d_cython
+    import torch
+    import torch.nn as nn
 except ImportError:
-    print('run the following from the cs231n directory and try again:')
-    print('python setup.py build_ext --inplace')
-    print('You may also need to restart your iPython kernel')
+    torch = None
 
 from cs231n.im2col import *
+from cs231n.layers import conv_forward_naive, conv_backward_naive
+
+# Use the Cython im2col extension if it has been built (run
+# python setup.py build_ext --inplace from the cs231n directory), and
+# otherwise the NumPy versions in im2col.py, which compute the same thing.
+try:
+    from cs231n.im2col_cython import col2im_cython, im2col_cython
+    from cs231n.im2col_cython import col2im_6d_cython
+    im2col_fast = im2col_cython
+    col2im_fast = col2im_cython
+    col2im_6d_fast = col2im_6d_cython
+    HAVE_CYTHON = True
+except ImportError:
+    im2col_fast = im2col_strided
+    col2im_fast = col2im_strided
+    col2im_6d_fast = col2im_6d_strided
+    HAVE_CYTHON = False
 
 
 def conv_forward_im2col(x, w, b, conv_param):
     """
     A fast implementation of the forward pass for a convolutional layer
     based on im2col and col2im.
+
+    1x1 filters are handed to conv_forward_1x1. If conv_param has a
+    'max_workspace_bytes' entry and the column matrix of
+    im2col would be larger than that, the layer is computed tile by tile by
+    conv_forward_tiled instead.
     """
     N, C, H, W = x.shape
     num_filters, _, filter_height, filter_width = w.shape
     stride, pad = conv_param['stride'], conv_param['pad']
 
+    if filter_height == filter_width == 1:
+        return conv_forward_1x1(x, w, b, conv_param)
+
     # Check dimensions
     assert (W + 2 * pad - filter_width) % stride == 0, 'width does not work'
     assert (H + 2 * pad - filter_height) % stride == 0, 'height does not work'
@@ -29,10 +56,12 @@ def conv_forward_im2col(x, w, b, conv_param):
     # Create output
     out_height = (H + 2 * pad - filter_height) // stride + 1
     out_width = (W + 2 * pad - filter_width) // stride + 1
+    if _conv_exceeds_workspace(x, w, conv_param):
+        return conv_forward_tiled(x, w, b, conv_param)
     out = np.zeros((N, num_filters, out_height, out_width), dtype=x.dtype)
 
     # x_cols = im2col_indices(x, w.shape[2], w.shape[3], pad, stride)
-    x_cols = im2col_cython(x, w.shape[2], w.shape[3], pad, stride)
+    x_cols = im2col_fast(x, w.shape[2], w.shape[3], pad, stride)
     res = w.reshape((w.shape[0], -1)).dot(x_cols) + b.reshape(-1, 1)
 
     out = res.reshape(w.shape[0], out.shape[2], out.shape[3], x.shape[0])
@@ -42,7 +71,14 @@ def conv_forward_im2col(x, w, b, conv_param):
     return out, cache
 
 
+def _require_torch():
+    if torch is None:
+        raise ImportError('conv_forward_pytorch and conv_backward_pytorch '
+                          'need PyTorch, which is not installed')
+
+
 def conv_forward_pytorch(x, w, b, conv_param):
+    _require_torch()
     N, C, H, W = x.shape
     F, _, HH, WW = w.shape
     stride, pad = conv_param['stride'], conv_param['pad']
@@ -55,6 +91,7 @@ def conv_forward_pytorch(x, w, b, conv_param):
     return out, cache
 
 def conv_backward_pytorch(dout, cache):
+    _require_torch()
     x, _, _, _, tx, out, layer = cache
     out.backward(torch.tensor(dout))
     dx = tx.grad.detach().numpy()
@@ -63,10 +100,21 @@ def conv_backward_pytorch(dout, cache):
     return dx, dw, db
 
 def conv_forward_strides(x, w, b, conv_param):
+    """
+    A fast implementation of the forward pass for a convolutional layer that
+    builds the column matrix of im2col from a strided view of the input. Like
+    conv_forward_im2col it hands 1x1 filters to conv_forward_1x1 and honors
+    conv_param['max_workspace_bytes'].
+    """
     N, C, H, W = x.shape
     F, _, HH, WW = w.shape
     stride, pad = conv_param['stride'], conv_param['pad']
 
+    if HH == WW == 1:
+        return conv_forward_1x1(x, w, b, conv_param)
+    if _conv_exceeds_workspace(x, w, conv_param):
+        return conv_forward_tiled(x, w, b, conv_param)
+
     # Check dimensions
     #assert (W + 2 * pad - WW) % stride == 0, 'width does not work'
     #assert (H + 2 * pad - HH) % stride == 0, 'height does not work'
@@ -108,6 +156,10 @@ def conv_forward_strides(x, w, b, conv_param):
 
 def conv_backward_strides(dout, cache):
     x, w, b, conv_param, x_cols = cache
+    if x_cols is None and w.shape[2] == w.shape[3] == 1:
+        return conv_backward_1x1(dout, cache)
+    if x_cols is None:
+        return conv_backward_tiled(dout, cache)
     stride, pad = conv_param['stride'], conv_param['pad']
 
     N, C, H, W = x.shape
@@ -121,7 +173,7 @@ def conv_backward_strides(dout, cache):
 
     dx_cols = w.reshape(F, -1).T.dot(dout_reshaped)
     dx_cols.shape = (C, HH, WW, N, out_h, out_w)
-    dx = col2im_6d_cython(dx_cols, N, C, H, W, HH, WW, pad, stride)
+    dx = col2im_6d_fast(dx_cols, N, C, H, W, HH, WW, pad, stride)
 
     return dx, dw, db
 
@@ -132,6 +184,10 @@ def conv_backward_im2col(dout, cache):
     based on im2col and col2im.
     """
     x, w, b, conv_param, x_cols = cache
+    if x_cols is None and w.shape[2] == w.shape[3] == 1:
+        return conv_backward_1x1(dout, cache)
+    if x_cols is None:
+        return conv_backward_tiled(dout, cache)
     stride, pad = conv_param['stride'], conv_param['pad']
 
     db = np.sum(dout, axis=(0, 2, 3))
@@ -142,8 +198,561 @@ def conv_backward_im2col(dout, cache):
 
     dx_cols = w.reshape(num_filters, -1).T.dot(dout_reshaped)
     # dx = col2im_indices(dx_cols, x.shape, filter_height, filter_width, pad, stride)
-    dx = col2im_cython(dx_cols, x.shape[0], x.shape[1], x.shape[2], x.shape[3],
-                       filter_height, filter_width, pad, stride)
+    dx = col2im_fast(dx_cols, x.shape[0], x.shape[1], x.shape[2], x.shape[3],
+                     filter_height, filter_width, pad, stride)
+
+    return dx, dw, db
+
+
+def _1x1_slices(H, W, stride, pad):
+    """
+    For a layer with 1x1 filters, output position (i, j) reads input position
+    (i * stride - pad, j * stride - pad). Find the output positions that read
+    the input rather than the zero padding, and the input positions they
+    read. Returns slices (out_i, out_j, x_i, x_j) such that out[:, :, out_i,
+    out_j] is computed from x[:, :, x_i, x_j].
+    """
+    out_h = (H + 2 * pad - 1) // stride + 1
+    out_w = (W + 2 * pad - 1) // stride + 1
+    i0 = j0 = -(-pad // stride)
+    i1 = min(out_h, (H + pad - 1) // stride + 1)
+    j1 = min(out_w, (W + pad - 1) // stride + 1)
+    x_i = slice(i0 * stride - pad, (i1 - 1) * stride - pad + 1, stride)
+    x_j = slice(j0 * stride - pad, (j1 - 1) * stride - pad + 1, stride)
+    return slice(i0, i1), slice(j0, j1), x_i, x_j
+
+
+def conv_forward_1x1(x, w, b, conv_param):
+    """
+    The forward pass for a convolutional layer with 1x1 filters. Such a layer
+    is a matrix multiply over channels, so it is computed as one batched
+    (F, C) x (C, H' * W') product per image on a reshaped view of the input
+    (subsampled if stride > 1), with no padding or column matrix. Outputs
+    that only see padding are just the bias.
+
+    The cache has the layout of conv_forward_strides with x_cols set to None.
+    """
+    N, C, H, W = x.shape
+    F = w.shape[0]
+    stride, pad = conv_param['stride'], conv_param['pad']
+    out_i, out_j, x_i, x_j = _1x1_slices(H, W, stride, pad)
+    x_sub = x[:, :, x_i, x_j]
+    _, _, sub_h, sub_w = x_sub.shape
+
+    out_sub = np.matmul(w.reshape(F, C), x_sub.reshape(N, C, -1))
+    out_sub += b.reshape(-1, 1)
+    out_sub.shape = (N, F, sub_h, sub_w)
+    if pad == 0:
+        out = out_sub
+    else:
+        out_h = (H + 2 * pad - 1) // stride + 1
+        out_w = (W + 2 * pad - 1) // stride + 1
+        out = np.empty((N, F, out_h, out_w), dtype=out_sub.dtype)
+        out[...] = b.reshape(-1, 1, 1)
+        out[:, :, out_i, out_j] = out_sub
+
+    cache = (x, w, b, conv_param, None)
+    return out, cache
+
+
+def conv_backward_1x1(dout, cache):
+    """
+    The backward pass for a convolutional layer with 1x1 filters.
+    """
+    x, w, b, conv_param, _ = cache
+    N, C, H, W = x.shape
+    F = w.shape[0]
+    stride, pad = conv_param['stride'], conv_param['pad']
+    out_i, out_j, x_i, x_j = _1x1_slices(H, W, stride, pad)
+
+    db = np.sum(dout, axis=(0, 2, 3))
+
+    dout_sub = dout[:, :, out_i, out_j]
+    _, _, sub_h, sub_w = dout_sub.shape
+    dout_sub = dout_sub.reshape(N, F, -1)
+    x_sub = x[:, :, x_i, x_j].reshape(N, C, -1)
+    dw = np.tensordot(dout_sub, x_sub, axes=([0, 2], [0, 2]))
+    dw = dw.reshape(w.shape)
+
+    dx_sub = np.matmul(w.reshape(F, C).T, dout_sub)
+    dx_sub.shape = (N, C, sub_h, sub_w)
+    if stride == 1 and pad == 0:
+        dx = dx_sub
+    else:
+        dx = np.zeros_like(x)
+        dx[:, :, x_i, x_j] = dx_sub
+
+    return dx, dw, db
+
+
+def _conv_exceeds_workspace(x, w, conv_param):
+    """
+    Check whether the column matrix of im2col for a layer would be larger
+    than conv_param['max_workspace_bytes'], if that is given.
+    """
+    max_bytes = conv_param.get('max_workspace_bytes')
+    if max_bytes is None:
+        return False
+    N, C, H, W = x.shape
+    F, _, HH, WW = w.shape
+    stride, pad = conv_param['stride'], conv_param['pad']
+    out_h = (H + 2 * pad - HH) // stride + 1
+    out_w = (W + 2 * pad - WW) // stride + 1
+    return C * HH * WW * N * out_h * out_w * x.itemsize > max_bytes
+
+
+def _conv_tiles(x, w, conv_param):
+    """
+    Split the output of a layer into tiles whose column matrices fit in
+    conv_param['max_workspace_bytes']: whole images if at least one fits, and
+    otherwise bands of output rows of a single image. Yields tuples
+    (n0, n1, r0, r1) of image and output row ranges.
+    """
+    N, C, H, W = x.shape
+    F, _, HH, WW = w.shape
+    stride, pad = conv_param['stride'], conv_param['pad']
+    out_h = (H + 2 * pad - HH) // stride + 1
+    out_w = (W + 2 * pad - WW) // stride + 1
+
+    row_bytes = C * HH * WW * out_w * x.itemsize
+    max_rows = max(conv_param['max_workspace_bytes'] // row_bytes, 1)
+    if max_rows >= out_h:
+        images = max_rows // out_h
+        for n0 in range(0, N, images):
+            yield n0, min(n0 + images, N), 0, out_h
+    else:
+        for n0 in range(N):
+            for r0 in range(0, out_h, max_rows):
+                yield n0, n0 + 1, r0, min(r0 + max_rows, out_h)
+
+
+def _tile_cols(x_padded, w, conv_param, n0, n1, r0, r1, out_w):
+    """
+    Build the column matrix of shape (C * HH * WW, (n1 - n0) * (r1 - r0) *
+    out_w), in the layout of conv_forward_strides, for one tile.
+    """
+    _, C, _, _ = x_padded.shape
+    _, _, HH, WW = w.shape
+    stride = conv_param['stride']
+    x_tile = x_padded[n0:n1, :, r0 * stride:(r1 - 1) * stride + HH]
+    sN, sC, sH, sW = x_tile.strides
+    shape = (C, HH, WW, n1 - n0, r1 - r0, out_w)
+    strides = (sC, sH, sW, sN, stride * sH, stride * sW)
+    x_stride = np.lib.stride_tricks.as_strided(x_tile, shape=shape,
+                                               strides=strides)
+    x_cols = np.ascontiguousarray(x_stride)
+    x_cols.shape = (C * HH * WW, -1)
+    return x_cols
+
+
+def conv_forward_tiled(x, w, b, conv_param):
+    """
+    The forward pass for a convolutional layer computed with im2col one tile
+    at a time, so that no column matrix is larger than
+    conv_param['max_workspace_bytes']. Tiles hold as many whole images as fit
+    the budget, or bands of output rows of one image if a single image does
+    not fit. conv_forward_im2col and conv_forward_strides use this when the
+    budget is exceeded.
+
+    The column matrices are not kept; the cache has x_cols set to None, which
+    the backward passes of those layers dispatch on.
+    """
+    N, C, H, W = x.shape
+    F, _, HH, WW = w.shape
+    stride, pad = conv_param['stride'], conv_param['pad']
+    p = pad
+    x_padded = np.pad(x, ((0, 0), (0, 0), (p, p), (p, p)), mode='constant')
+    out_h = (H + 2 * pad - HH) // stride + 1
+    out_w = (W + 2 * pad - WW) // stride + 1
+
+    w_reshaped = w.reshape(F, -1)
+    out = np.empty((N, F, out_h, out_w), dtype=x.dtype)
+    for n0, n1, r0, r1 in _conv_tiles(x, w, conv_param):
+        x_cols = _tile_cols(x_padded, w, conv_param, n0, n1, r0, r1, out_w)
+        res = w_reshaped.dot(x_cols) + b.reshape(-1, 1)
+        res.shape = (F, n1 - n0, r1 - r0, out_w)
+        out[n0:n1, :, r0:r1] = res.transpose(1, 0, 2, 3)
+
+    cache = (x, w, b, conv_param, None)
+    return out, cache
+
+
+def conv_backward_tiled(dout, cache):
+    """
+    The backward pass for a convolutional layer computed by
+    conv_forward_tiled. The column matrices are rebuilt tile by tile, dw is
+    accumulated in place over the tiles and the gradient of every tile is
+    added into dx with col2im.
+    """
+    x, w, b, conv_param, _ = cache
+    N, C, H, W = x.shape
+    F, _, HH, WW = w.shape
+    stride, pad = conv_param['stride'], conv_param['pad']
+    _, _, out_h, out_w = dout.shape
+    p = pad
+    x_padded = np.pad(x, ((0, 0), (0, 0), (p, p), (p, p)), mode='constant')
+
+    db = np.sum(dout, axis=(0, 2, 3))
+
+    w_reshaped = w.reshape(F, -1)
+    dw = np.zeros_like(w_reshaped)
+    dx_padded = np.zeros_like(x_padded)
+    W_padded = W + 2 * p
+    for n0, n1, r0, r1 in _conv_tiles(x, w, conv_param):
+        x_cols = _tile_cols(x_padded, w, conv_param, n0, n1, r0, r1, out_w)
+        dout_tile = dout[n0:n1, :, r0:r1].transpose(1, 0, 2, 3).reshape(F, -1)
+        dw += dout_tile.dot(x_cols.T)
+
+        dx_cols = w_reshaped.T.dot(dout_tile)
+        dx_cols.shape = (C, HH, WW, n1 - n0, r1 - r0, out_w)
+        h0, h1 = r0 * stride, (r1 - 1) * stride + HH
+        dx_padded[n0:n1, :, h0:h1] += col2im_6d_fast(
+            dx_cols, n1 - n0, C, h1 - h0, W_padded, HH, WW, 0, stride)
+
+    dx = dx_padded[:, :, p:p + H, p:p + W]
+    dw = dw.reshape(w.shape)
+    return dx, dw, db
+
+
+def conv_forward_fft(x, w, b, conv_param):
+    """
+    An implementation of the forward pass for a convolutional layer based on
+    the FFT. Its cost grows with H * W * log(H * W) rather than with the filter
+    size, so it pays off for large filters.
+
+    The padded input and the filters are transformed with rfft2 to the size of
+    the padded input. At every frequency the spectrum of the output is then a
+    product of an (N, C) and a (C, F) matrix, which is computed for all
+    frequencies at once with a batched matrix multiply. The inverse transform
+    gives the output at stride 1, which is subsampled for larger strides.
+    """
+    N, C, H, W = x.shape
+    F, _, HH, WW = w.shape
+    stride, pad = conv_param['stride'], conv_param['pad']
+    p = pad
+    x_padded = np.pad(x, ((0, 0), (0, 0), (p, p), (p, p)), mode='constant')
+    H_padded, W_padded = H + 2 * p, W + 2 * p
+    out_h = (H_padded - HH) // stride + 1
+    out_w = (W_padded - WW) // stride + 1
+    size = (H_padded, W_padded)
+
+    # Spectra with the frequencies first: shapes (K, N, C) and (K, C, F)
+    x_hat = np.fft.rfft2(x_padded, s=size)
+    w_hat = np.fft.rfft2(w, s=size)
+    K = x_hat.shape[2] * x_hat.shape[3]
+    x_hat = x_hat.transpose(2, 3, 0, 1).reshape(K, N, C)
+    w_hat = w_hat.transpose(2, 3, 1, 0).reshape(K, C, F)
+
+    # Cross-correlation is multiplication by the conjugate filter spectrum;
+    # the outputs we keep never wrap around the circular correlation.
+    out_hat = np.matmul(x_hat, w_hat.conj())
+    out_hat = out_hat.reshape(H_padded, -1, N, F).transpose(2, 3, 0, 1)
+    out = np.fft.irfft2(out_hat, s=size)
+    out = out[:, :, :stride * out_h:stride, :stride * out_w:stride]
+    out = out + b.reshape(1, -1, 1, 1)
+    out = out.astype(x.dtype, copy=False)
+
+    cache = (x, w, b, conv_param, x_hat, w_hat)
+    return out, cache
+
+
+def conv_backward_fft(dout, cache):
+    """
+    An implementation of the backward pass for a convolutional layer based on
+    the FFT, reusing the spectra of the input and filters from
+    conv_forward_fft.
+    """
+    x, w, b, conv_param, x_hat, w_hat = cache
+    N, C, H, W = x.shape
+    F, _, HH, WW = w.shape
+    stride, pad = conv_param['stride'], conv_param['pad']
+    _, _, out_h, out_w = dout.shape
+    H_padded, W_padded = H + 2 * pad, W + 2 * pad
+    size = (H_padded, W_padded)
+
+    db = np.sum(dout, axis=(0, 2, 3))
+
+    # Upstream gradient at stride 1, zero at the skipped positions
+    dout_full = np.zeros((N, F, H_padded, W_padded), dtype=dout.dtype)
+    dout_full[:, :, :stride * out_h:stride, :stride * out_w:stride] = dout
+    dout_hat = np.fft.rfft2(dout_full)
+    K = dout_hat.shape[2] * dout_hat.shape[3]
+    dout_hat = dout_hat.transpose(2, 3, 0, 1).reshape(K, N, F)
+
+    # dx is the convolution of the upstream gradient with the filters
+    dx_hat = np.matmul(dout_hat, w_hat.transpose(0, 2, 1))
+    dx_hat = dx_hat.reshape(H_padded, -1, N, C).transpose(2, 3, 0, 1)
+    dx = np.fft.irfft2(dx_hat, s=size)
+    dx = dx[:, :, pad:pad + H, pad:pad + W].astype(x.dtype)
+
+    # dw is the cross-correlation of the input with the upstream gradient
+    dw_hat = np.matmul(dout_hat.conj().transpose(0, 2, 1), x_hat)
+    dw_hat = dw_hat.reshape(H_padded, -1, F, C).transpose(2, 3, 0, 1)
+    dw = np.fft.irfft2(dw_hat, s=size)
+    dw = dw[:, :, :HH, :WW].astype(w.dtype)
+
+    return dx, dw, db
+
+
+def _conv_dw_taps(dout, x_padded, w, stride):
+    """
+    Compute the gradient with respect to the filters w of a convolutional
+    layer with one GEMM per filter tap, each against a strided view of the
+    padded input, without building the column matrix of im2col.
+    """
+    _, _, out_h, out_w = dout.shape
+    _, _, HH, WW = w.shape
+    dw = np.empty_like(w)
+    for i in range(HH):
+        for j in range(WW):
+            x_tap = x_padded[:, :, i:i + stride * out_h:stride,
+                             j:j + stride * out_w:stride]
+            dw[:, :, i, j] = np.tensordot(dout, x_tap,
+                                          axes=([0, 2, 3], [0, 2, 3]))
+    return dw
+
+
+def conv_forward_implicit_gemm(x, w, b, conv_param):
+    """
+    An implementation of the forward pass for a convolutional layer as an
+    implicit GEMM: rather than building the (C * HH * WW, N * H' * W') column
+    matrix of im2col, it loops over the HH * WW filter taps and accumulates
+    one (F, C) x (C, N * H' * W') product per tap, each against a strided
+    view of the padded input. Peak memory stays close to the size of the
+    input and output, and the cache only holds x and w.
+    """
+    N, C, H, W = x.shape
+    F, _, HH, WW = w.shape
+    stride, pad = conv_param['stride'], conv_param['pad']
+    p = pad
+    x_padded = np.pad(x, ((0, 0), (0, 0), (p, p), (p, p)), mode='constant')
+    out_h = (H + 2 * pad - HH) // stride + 1
+    out_w = (W + 2 * pad - WW) // stride + 1
+
+    # Accumulate with the filters first, the layout the GEMMs produce
+    out = np.zeros((F, N, out_h, out_w), dtype=x.dtype)
+    for i in range(HH):
+        for j in range(WW):
+            x_tap = x_padded[:, :, i:i + stride * out_h:stride,
+                             j:j + stride * out_w:stride]
+            out += np.tensordot(w[:, :, i, j], x_tap, axes=([1], [1]))
+    out += b.reshape(-1, 1, 1, 1)
+    out = np.ascontiguousarray(out.transpose(1, 0, 2, 3))
+
+    cache = (x, w, b, conv_param)
+    return out, cache
+
+
+def conv_backward_implicit_gemm(dout, cache):
+    """
+    An implementation of the backward pass for a convolutional layer as an
+    implicit GEMM, with one product per filter tap for each of dx and dw.
+    """
+    x, w, b, conv_param = cache
+    N, C, H, W = x.shape
+    F, _, HH, WW = w.shape
+    stride, pad = conv_param['stride'], conv_param['pad']
+    _, _, out_h, out_w = dout.shape
+    p = pad
+    x_padded = np.pad(x, ((0, 0), (0, 0), (p, p), (p, p)), mode='constant')
+
+    db = np.sum(dout, axis=(0, 2, 3))
+    dw = _conv_dw_taps(dout, x_padded, w, stride)
+
+    # Accumulate with the channels first, the layout the GEMMs produce
+    dx_padded = np.zeros((C, N, H + 2 * p, W + 2 * p), dtype=x.dtype)
+    for i in range(HH):
+        for j in range(WW):
+            dx_padded[:, :, i:i + stride * out_h:stride,
+                      j:j + stride * out_w:stride] += np.tensordot(
+                          w[:, :, i, j], dout, axes=([0], [1]))
+    dx = dx_padded[:, :, p:p + H, p:p + W].transpose(1, 0, 2, 3)
+    dx = np.ascontiguousarray(dx)
+
+    return dx, dw, db
+
+
+# Transforms of the Winograd minimal filtering algorithm F(2x2, 3x3), which
+# computes a 2x2 tile of the output of a 3x3 filter from a 4x4 tile of the
+# input with 16 rather than 36 multiplies: with d an input tile and g a
+# filter, the output tile is A^T [(G g G^T) * (B^T d B)] A, where
+#
+#   B^T = [[1,  0, -1,  0],   G = [[  1,    0,   0],   A^T = [[1, 1,  1,  0],
+#          [0,  1,  1,  0],        [1/2,  1/2, 1/2],          [0, 1, -1, -1]]
+#          [0, -1,  1,  0],        [1/2, -1/2, 1/2],
+#          [0,  1,  0, -1]]        [  0,    0,   1]]
+_WINOGRAD_G = np.array([[1, 0, 0],
+                        [0.5, 0.5, 0.5],
+                        [0.5, -0.5, 0.5],
+                        [0, 0, 1]], dtype=np.float64)
+
+# Each row of B^T adds or subtracts two entries: (first, second, sign)
+_WINOGRAD_BT = [(0, 2, -1), (1, 2, 1), (2, 1, -1), (1, 3, -1)]
+
+
+def _winograd_combine(a, b, sign, out):
+    """ Write a + b or a - b, depending on sign, into out """
+    if sign > 0:
+        np.add(a, b, out=out)
+    else:
+        np.subtract(a, b, out=out)
+
+
+def _winograd_at_row(m, i, out):
+    """ Apply row i of A^T along the first axis of m, writing into out """
+    if i == 0:
+        np.add(m[0], m[1], out=out)
+        out += m[2]
+    else:
+        np.subtract(m[1], m[2], out=out)
+        out -= m[3]
+
+# Transformed filters of recently seen weight arrays, keyed on the identity
+# of the array, with the least recently used ones evicted beyond
+# WINOGRAD_CACHE_SIZE; 0 turns the cache off. Each entry holds a weak
+# reference to its array, so it is dropped as soon as the array is freed,
+# as happens to the old weights after every update of the Solver. It also
+# keeps a copy of the weights it was computed from, so updating the weights
+# in place invalidates it.
+WINOGRAD_CACHE_SIZE = 16
+_winograd_filter_cache = OrderedDict()
+
+
+def winograd_cache_clear():
+    """ Empty the transformed filter cache of conv_forward_winograd """
+    _winograd_filter_cache.clear()
+
+
+def _winograd_filters(w):
+    """
+    Transform filters of shape (F, C, 3, 3) to shape (16, F, C), reusing the
+    result of an earlier call with the same unchanged weights.
+    """
+    key = id(w)
+    entry = _winograd_filter_cache.get(key)
+    if (entry is not None and entry[0]() is w
+            and np.array_equal(entry[1], w)):
+        # Mark the entry as the most recently used one
+        _winograd_filter_cache[key] = _winograd_filter_cache.pop(key)
+        return entry[2]
+
+    F, C, _, _ = w.shape
+    G = _WINOGRAD_G.astype(w.dtype)
+    U = np.matmul(np.matmul(G, w), G.T)
+    U = U.transpose(2, 3, 0, 1).reshape(16, F, C)
+
+    _winograd_filter_cache.pop(key, None)
+    if WINOGRAD_CACHE_SIZE > 0:
+        def drop(ref):
+            # Only drop the entry if it still belongs to the freed array
+            entry = _winograd_filter_cache.get(key)
+            if entry is not None and entry[0] is ref:
+                del _winograd_filter_cache[key]
+        _winograd_filter_cache[key] = (weakref.ref(w, drop), w.copy(), U)
+    while len(_winograd_filter_cache) > max(WINOGRAD_CACHE_SIZE, 0):
+        _winograd_filter_cache.popitem(last=False)
+    return U
+
+
+def _winograd_correlate(x, U, pad):
+    """
+    Cross-correlate x of shape (N, C, H, W) at stride 1 with 3x3 filters
+    whose Winograd transform U has shape (16, F, C). Returns an array of
+    shape (N, F, H + 2 * pad - 2, W + 2 * pad - 2).
+    """
+    N, C, H, W = x.shape
+    F = U.shape[1]
+    out_h, out_w = H + 2 * pad - 2, W + 2 * pad - 2
+    tiles_h, tiles_w = (out_h + 1) // 2, (out_w + 1) // 2
+
+    # Pad so that the input splits into overlapping 4x4 tiles with stride 2
+    extra_h, extra_w = 2 * tiles_h - out_h, 2 * tiles_w - out_w
+    x_padded = np.pad(x, ((0, 0), (0, 0), (pad, pad + extra_h),
+                          (pad, pad + extra_w)), mode='constant')
+    sN, sC, sH, sW = x_padded.strides
+    tiles = np.lib.stride_tricks.as_strided(x_padded,
+                shape=(C, 4, 4, N, tiles_h, tiles_w),
+                strides=(sC, sH, sW, sN, 2 * sH, 2 * sW))
+
+    # Input transform B^T d B, giving V of shape (16, C, P). B^T only holds
+    # zeros and ones, so it is applied with additions: to the rows of the
+    # tiles one row of V at a time, then to the columns of that row.
+    V = np.empty((4, 4, C, N, tiles_h, tiles_w), dtype=x.dtype)
+    t = np.empty((C, 4, N, tiles_h, tiles_w), dtype=x.dtype)
+    for i, (r0, r1, sign) in enumerate(_WINOGRAD_BT):
+        _winograd_combine(tiles[:, r0], tiles[:, r1], sign, t)
+        for j, (c0, c1, sign) in enumerate(_WINOGRAD_BT):
+            _winograd_combine(t[:, c0], t[:, c1], sign, V[i, j])
+    del tiles, x_padded, t
+    V = V.reshape(16, C, -1)
+
+    # Elementwise products summed over channels: one GEMM per tile position
+    M = np.matmul(U, V)
+    del V
+    M = M.reshape(4, 4, F, N, tiles_h, tiles_w)
+
+    # Output transform A^T m A, written straight into the 2x2 output tiles:
+    # first to the rows of m for one row of output tiles, then to its
+    # columns.
+    out = np.empty((N, F, tiles_h, 2, tiles_w, 2), dtype=M.dtype)
+    z = np.empty((4, F, N, tiles_h, tiles_w), dtype=M.dtype)
+    for i in range(2):
+        _winograd_at_row(M, i, z)
+        for j in range(2):
+            _winograd_at_row(z, j, out[:, :, :, i, :, j].swapaxes(0, 1))
+    out = out.reshape(N, F, 2 * tiles_h, 2 * tiles_w)
+    return out[:, :, :out_h, :out_w]
+
+
+def conv_forward_winograd(x, w, b, conv_param):
+    """
+    An implementation of the forward pass for a convolutional layer with 3x3
+    filters and stride 1, based on the Winograd algorithm F(2x2, 3x3). It
+    needs 16 multiplies for every 2x2 block of outputs where im2col needs
+    36, and never builds the 9x larger column matrix.
+
+    The transformed filters are cached and reused as long as the weights do
+    not change. The output agrees with conv_forward_naive to within 1e-14 in
+    float64 and 1e-6 in float32, relative to the largest output magnitude.
+    """
+    F, C, HH, WW = w.shape
+    stride, pad = conv_param['stride'], conv_param['pad']
+    assert HH == WW == 3 and stride == 1, 'Invalid conv params'
+
+    U = _winograd_filters(w)
+    out = _winograd_correlate(x, U, pad)
+    out += b.reshape(1, -1, 1, 1)
+
+    cache = (x, w, b, conv_param, U)
+    return out, cache
+
+
+def conv_backward_winograd(dout, cache):
+    """
+    An implementation of the backward pass for a convolutional layer with 3x3
+    filters and stride 1. dx is the full correlation of the upstream gradient
+    with the flipped filters, which is again computed with Winograd; dw is
+    computed with one GEMM per filter tap.
+    """
+    x, w, b, conv_param, U = cache
+    N, C, H, W = x.shape
+    F, _, HH, WW = w.shape
+    pad = conv_param['pad']
+    _, _, out_h, out_w = dout.shape
+
+    db = np.sum(dout, axis=(0, 2, 3))
+
+    # Flipping a filter swaps the first and last rows of G g G^T and its
+    # columns, so the transform of the flipped filters comes from U directly.
+    flip = [3, 1, 2, 0]
+    U_flipped = U.reshape(4, 4, F, C)[flip][:, flip]
+    U_flipped = U_flipped.transpose(0, 1, 3, 2).reshape(16, C, F)
+    dx_padded = _winograd_correlate(dout, U_flipped, 2)
+    dx = dx_padded[:, :, pad:pad + H, pad:pad + W]
+
+    p = pad
+    x_padded = np.pad(x, ((0, 0), (0, 0), (p, p), (p, p)), mode='constant')
+    dw = _conv_dw_taps(dout, x_padded, w, 1)
 
     return dx, dw, db
 
@@ -152,27 +761,429 @@ conv_forward_fast = conv_forward_strides
 conv_backward_fast = conv_backward_strides
 
 
-def max_pool_forward_fast(x, pool_param):
+# Convolution backends. Every implementation of the convolutional layer is
+# registered under a name, and conv_forward and conv_backward dispatch to the
+# fastest one for each layer shape. The first time conv_forward sees a shape it
+# times the forward and backward pass of every backend that supports it and
+# remembers the winner in memory and, after set_conv_autotune_file has been
+# called, in a JSON file that later processes start from.
+_conv_backends = OrderedDict()
+_conv_autotune_cache = {}
+_conv_autotune_file = None
+
+
+def register_conv_backend(name, forward, backward, supports=None,
+                          autotune=True):
     """
-    A fast implementation of the forward pass for a max pooling layer.
+    Make an implementation of the convolutional layer available to
+    conv_forward.
+
+    Inputs:
+    - name: String naming the backend; registering a name again replaces it.
+    - forward, backward: Functions with the same signatures as
+      conv_forward_naive and conv_backward_naive.
+    - supports: Optional function supports(x_shape, w_shape, conv_param)
+      returning whether the backend can compute a layer. By default it is
+      assumed to handle every layer. Backends that cannot keep their
+      workspace within conv_param['max_workspace_bytes'] should return False
+      when it is set.
+    - autotune: Whether conv_forward should time this backend. Backends that
+      are too slow to be worth timing, like the naive one, set this to False;
+      they are only used for layers that no other backend supports.
+    """
+    _conv_backends[name] = {
+      'forward': forward,
+      'backward': backward,
+      'supports': supports,
+      'autotune': autotune,
+    }
+
+
+def set_conv_autotune_file(filename):
+    """
+    Remember autotuning results in a JSON file. Results already in the file
+    are loaded, and the file is rewritten every time a new shape is tuned.
+    Pass None to stop writing to the file.
+    """
+    global _conv_autotune_file
+    _conv_autotune_file = filename
+    if filename is not None and os.path.exists(filename):
+        with open(filename, 'r') as f:
+            _conv_autotune_cache.update(json.load(f))
+
+
+def _conv_key(x, w, conv_param):
+    """ The signature of a layer that autotuning results are stored under """
+    N, C, H, W = x.shape
+    F, _, HH, WW = w.shape
+    key = (N, C, H, W, F, HH, WW, conv_param['stride'], conv_param['pad'],
+           x.dtype.str)
+    if conv_param.get('max_workspace_bytes') is not None:
+        key += (conv_param['max_workspace_bytes'],)
+    return ','.join(str(k) for k in key)
+
+
+def _conv_candidates(x, w, conv_param):
+    supported = [name for name, backend in _conv_backends.items()
+                 if backend['supports'] is None
+                 or backend['supports'](x.shape, w.shape, conv_param)]
+    tuned = [name for name in supported if _conv_backends[name]['autotune']]
+    return tuned or supported
+
+
+def autotune_conv(x, w, b, conv_param, num_trials=3):
+    """
+    Find the fastest backend for a convolutional layer, by timing the forward
+    and backward pass of every candidate backend on the given inputs.
+
+    Inputs:
+    - x, w, b, conv_param: As for conv_forward_naive.
+    - num_trials: Number of times to time each backend; the best time counts.
+
+    Returns:
+    - name: The name of the fastest backend.
+    """
+    candidates = _conv_candidates(x, w, conv_param)
+    if not candidates:
+        raise ValueError('No convolution backend supports x of shape %s and '
+                         'w of shape %s' % (x.shape, w.shape))
+    if len(candidates) == 1:
+        return candidates[0]
+
+    best_name, best_time = None, None
+    dout = None
+    for name in candidates:
+        backend = _conv_backends[name]
+        for _ in range(num_trials):
+            start = time.time()
+            out, cache = backend['forward'](x, w, b, conv_param)
+            if dout is None:
+                dout = np.ones_like(out)
+            backend['backward'](dout, cache)
+            elapsed = time.time() - start
+            if best_time is None or elapsed < best_time:
+                best_name, best_time = name, elapsed
+    return best_name
+
+
+def conv_forward(x, w, b, conv_param):
+    """
+    The forward pass for a convolutional layer, computed by the fastest
+    registered backend for its shape.
+
+    Inputs and outputs are as for conv_forward_naive; the cache must be passed
+    to conv_backward.
+    """
+    key = _conv_key(x, w, conv_param)
+    name = _conv_autotune_cache.get(key)
+    if name not in _conv_backends:
+        name = autotune_conv(x, w, b, conv_param)
+        _conv_autotune_cache[key] = name
+        if _conv_autotune_file is not None:
+            tmp_file = _conv_autotune_file + '.tmp'
+            with open(tmp_file, 'w') as f:
+                json.dump(_conv_autotune_cache, f, indent=2, sort_keys=True)
+            os.rename(tmp_file, _conv_autotune_file)
+
+    out, cache = _conv_backends[name]['forward'](x, w, b, conv_param)
+    return out, (name, cache)
+
+
+def conv_backward(dout, cache):
+    """
+    The backward pass for a convolutional layer, computed by the backend that
+    computed the forward pass.
+    """
+    name, real_cache = cache
+    return _conv_backends[name]['backward'](dout, real_cache)
+
+
+def _im2col_supports(x_shape, w_shape, conv_param):
+    # conv_forward_im2col needs the filters to tile the padded input exactly
+    _, _, H, W = x_shape
+    _, _, HH, WW = w_shape
+    stride, pad = conv_param['stride'], conv_param['pad']
+    return (H + 2 * pad - HH) % stride == 0 and (W + 2 * pad - WW) % stride == 0
+
+
+def _1x1_supports(x_shape, w_shape, conv_param):
+    return w_shape[2] == w_shape[3] == 1
+
+
+def _no_workspace_budget(x_shape, w_shape, conv_param):
+    # Backends whose workspace does not shrink to fit
+    # conv_param['max_workspace_bytes'] must not be used (or even timed) for
+    # layers that set it.
+    return conv_param.get('max_workspace_bytes') is None
+
+
+def _winograd_supports(x_shape, w_shape, conv_param):
+    return (w_shape[2] == w_shape[3] == 3 and conv_param['stride'] == 1
+            and _no_workspace_budget(x_shape, w_shape, conv_param))
+
+
+def _conv_forward_pytorch_numpy(x, w, b, conv_param):
+    # conv_forward_pytorch returns a tensor; the other backends return arrays
+    out, cache = conv_forward_pytorch(x, w, b, conv_param)
+    return out.detach().numpy(), cache
+
+
+register_conv_backend('naive', conv_forward_naive, conv_backward_naive,
+                      autotune=False)
+register_conv_backend('im2col', conv_forward_im2col, conv_backward_im2col,
+                      supports=_im2col_supports)
+register_conv_backend('strides', conv_forward_strides, conv_backward_strides)
+register_conv_backend('fft', conv_forward_fft, conv_backward_fft,
+                      supports=_no_workspace_budget)
+register_conv_backend('1x1', conv_forward_1x1, conv_backward_1x1,
+                      supports=_1x1_supports)
+register_conv_backend('implicit_gemm', conv_forward_implicit_gemm,
+                      conv_backward_implicit_gemm,
+                      supports=_no_workspace_budget)
+register_conv_backend('winograd', conv_forward_winograd,
+                      conv_backward_winograd, supports=_winograd_supports)
+if torch is not None:
+    register_conv_backend('pytorch', _conv_forward_pytorch_numpy,
+                          conv_backward_pytorch,
+                          supports=_no_workspace_budget)
+
+
+def grouped_conv_forward_fast(x, w, b, conv_param):
+    """
+    A fast implementation of the forward pass for a grouped convolutional
+    layer; see grouped_conv_forward_naive for the inputs and outputs.
+
+    For every filter tap it does one batched matrix multiply of the
+    (G, F // G, C // G) filter weights of all groups with a strided view of
+    the padded input of shape (N, G, C // G, H' * W'). For depthwise layers,
+    with one channel per group, the products are elementwise instead.
+    """
+    N, C, H, W = x.shape
+    F, C_g, HH, WW = w.shape
+    stride, pad = conv_param['stride'], conv_param['pad']
+    G = conv_param.get('groups', 1)
+    assert C == G * C_g and F % G == 0, 'Invalid number of groups'
+    F_g = F // G
+    p = pad
+    x_padded = np.pad(x, ((0, 0), (0, 0), (p, p), (p, p)), mode='constant')
+    x_padded = x_padded.reshape(N, G, C_g, H + 2 * p, W + 2 * p)
+    out_h = (H + 2 * pad - HH) // stride + 1
+    out_w = (W + 2 * pad - WW) // stride + 1
+
+    w_grouped = w.reshape(G, F_g, C_g, HH, WW)
+    out = np.zeros((N, G, F_g, out_h * out_w), dtype=x.dtype)
+    for i in range(HH):
+        for j in range(WW):
+            x_tap = x_padded[:, :, :, i:i + stride * out_h:stride,
+                             j:j + stride * out_w:stride]
+            x_tap = x_tap.reshape(N, G, C_g, -1)
+            if C_g == 1:
+                out += w_grouped[:, :, :, i, j] * x_tap
+            else:
+                out += np.matmul(w_grouped[:, :, :, i, j], x_tap)
+    out = out.reshape(N, F, out_h, out_w)
+    out += b.reshape(-1, 1, 1)
+
+    cache = (x, w, b, conv_param)
+    return out, cache
+
 
-    This chooses between the reshape method and the im2col method. If the pooling
-    regions are square and tile the input image, then we can use the reshape
-    method which is very fast. Otherwise we fall back on the im2col method, which
-    is not much faster than the naive method.
+def grouped_conv_backward_fast(dout, cache):
     """
+    A fast implementation of the backward pass for a grouped convolutional
+    layer, with the same per-tap batched products as the forward pass.
+    """
+    x, w, b, conv_param = cache
     N, C, H, W = x.shape
+    F, C_g, HH, WW = w.shape
+    stride, pad = conv_param['stride'], conv_param['pad']
+    G = conv_param.get('groups', 1)
+    F_g = F // G
+    _, _, out_h, out_w = dout.shape
+    p = pad
+    x_padded = np.pad(x, ((0, 0), (0, 0), (p, p), (p, p)), mode='constant')
+    x_padded = x_padded.reshape(N, G, C_g, H + 2 * p, W + 2 * p)
+
+    db = np.sum(dout, axis=(0, 2, 3))
+
+    w_grouped = w.reshape(G, F_g, C_g, HH, WW)
+    dout_grouped = dout.reshape(N, G, F_g, -1)
+    dw = np.empty((G, F_g, C_g, HH, WW), dtype=w.dtype)
+    dx_padded = np.zeros_like(x_padded)
+    for i in range(HH):
+        for j in range(WW):
+            rows = slice(i, i + stride * out_h, stride)
+            cols = slice(j, j + stride * out_w, stride)
+            x_tap = x_padded[:, :, :, rows, cols].reshape(N, G, C_g, -1)
+            w_tap = w_grouped[:, :, :, i, j]
+            if C_g == 1:
+                dw[:, :, 0, i, j] = np.einsum('ngfp,ngp->gf', dout_grouped,
+                                              x_tap[:, :, 0])
+                dx_tap = np.einsum('gf,ngfp->ngp', w_tap[:, :, 0],
+                                   dout_grouped)[:, :, np.newaxis]
+            else:
+                dw[:, :, :, i, j] = np.matmul(
+                    dout_grouped, x_tap.transpose(0, 1, 3, 2)).sum(axis=0)
+                dx_tap = np.matmul(w_tap.transpose(0, 2, 1), dout_grouped)
+            dx_padded[:, :, :, rows, cols] += dx_tap.reshape(
+                N, G, C_g, out_h, out_w)
+
+    dx = dx_padded.reshape(N, C, H + 2 * p, W + 2 * p)[:, :, p:p + H,
+                                                         p:p + W]
+    dw = dw.reshape(w.shape)
+    return dx, dw, db
+
+
+def depthwise_separable_conv_forward(x, w_depth, b_depth, w_point, b_point,
+                                     conv_param):
+    """
+    The forward pass for a depthwise-separable convolutional layer: a
+    depthwise convolution, where every filter sees a single input channel,
+    followed by a pointwise 1x1 convolution that mixes the channels.
+
+    Inputs:
+    - x: Input data of shape (N, C, H, W)
+    - w_depth: Depthwise filters of shape (C * M, 1, HH, WW), M per channel
+    - b_depth: Depthwise biases, of shape (C * M,)
+    - w_point: Pointwise filters of shape (F, C * M, 1, 1)
+    - b_point: Pointwise biases, of shape (F,)
+    - conv_param: Dictionary with the 'stride' and 'pad' of the depthwise
+      convolution.
+
+    Returns a tuple of:
+    - out: Output data, of shape (N, F, H', W')
+    - cache: Object to give to the backward pass
+    """
+    depth_param = dict(conv_param, groups=x.shape[1])
+    a, depth_cache = grouped_conv_forward_fast(x, w_depth, b_depth,
+                                               depth_param)
+    out, point_cache = conv_forward_1x1(a, w_point, b_point,
+                                        {'stride': 1, 'pad': 0})
+    cache = (depth_cache, point_cache)
+    return out, cache
+
+
+def depthwise_separable_conv_backward(dout, cache):
+    """
+    The backward pass for a depthwise-separable convolutional layer.
+
+    Returns a tuple of:
+    - dx: Gradient with respect to x
+    - dw_depth, db_depth: Gradients of the depthwise filters and biases
+    - dw_point, db_point: Gradients of the pointwise filters and biases
+    """
+    depth_cache, point_cache = cache
+    da, dw_point, db_point = conv_backward_1x1(dout, point_cache)
+    dx, dw_depth, db_depth = grouped_conv_backward_fast(da, depth_cache)
+    return dx, dw_depth, db_depth, dw_point, db_point
+
+
+def conv_relu_pool_forward_fused(x, w, b, conv_param, pool_param):
+    """
+    A fused implementation of a convolution followed by a ReLU and a max
+    pool, computing the same thing as layer_utils.conv_relu_pool_forward
+    used to with three separate layers.
+
+    The convolution is one GEMM of the weights with the column matrix of
+    im2col, whose result has the filters first. The bias and ReLU are applied
+    to it in place, and it is pooled directly in that layout, so no other
+    full-size activation is allocated. The cache holds x_cols, the argmax of
+    every pooling window and whether every pooled output is positive; the
+    activations themselves are not kept.
+
+    If conv_param['max_workspace_bytes'] rules out the full column matrix,
+    the convolution is computed by conv_forward_tiled instead.
+
+    Inputs:
+    - x: Input to the convolutional layer
+    - w, b, conv_param: Weights and parameters for the convolutional layer
+    - pool_param: Parameters for the pooling layer
+
+    Returns a tuple of:
+    - out: Output from the pooling layer
+    - cache: Object to give to the backward pass
+    """
+    N, C, H, W = x.shape
+    F, _, HH, WW = w.shape
+    stride, pad = conv_param['stride'], conv_param['pad']
     pool_height, pool_width = pool_param['pool_height'], pool_param['pool_width']
-    stride = pool_param['stride']
+    pool_stride = pool_param['stride']
 
-    same_size = pool_height == pool_width == stride
-    tiles = H % pool_height == 0 and W % pool_width == 0
-    if same_size and tiles:
-        out, reshape_cache = max_pool_forward_reshape(x, pool_param)
-        cache = ('reshape', reshape_cache)
+    if _conv_exceeds_workspace(x, w, conv_param):
+        # Tiled convolution, with the images first
+        a, _ = conv_forward_tiled(x, w, b, conv_param)
+        x_cols = None
     else:
-        out, im2col_cache = max_pool_forward_im2col(x, pool_param)
-        cache = ('im2col', im2col_cache)
+        p = pad
+        x_padded = np.pad(x, ((0, 0), (0, 0), (p, p), (p, p)),
+                          mode='constant')
+        out_h = (H + 2 * pad - HH) // stride + 1
+        out_w = (W + 2 * pad - WW) // stride + 1
+        x_cols = _tile_cols(x_padded, w, conv_param, 0, N, 0, out_h, out_w)
+        a = w.reshape(F, -1).dot(x_cols)
+        a += b.reshape(-1, 1)
+        a.shape = (F, N, out_h, out_w)
+
+    np.maximum(a, 0, out=a)
+    out, argmax = _max_pool_taps(a, pool_height, pool_width, pool_stride)
+    positive = out > 0
+    if x_cols is not None:
+        out = np.ascontiguousarray(out.transpose(1, 0, 2, 3))
+
+    cache = (x, w, b, conv_param, pool_param, x_cols, a.shape, argmax,
+             positive)
+    return out, cache
+
+
+def conv_relu_pool_backward_fused(dout, cache):
+    """
+    Backward pass for conv_relu_pool_forward_fused.
+
+    Returns a tuple of:
+    - dx: Gradient with respect to x
+    - dw: Gradient with respect to w
+    - db: Gradient with respect to b
+    """
+    (x, w, b, conv_param, pool_param, x_cols, a_shape, argmax,
+     positive) = cache
+    N, C, H, W = x.shape
+    F, _, HH, WW = w.shape
+    stride, pad = conv_param['stride'], conv_param['pad']
+    pool_height, pool_width = pool_param['pool_height'], pool_param['pool_width']
+    pool_stride = pool_param['stride']
+
+    # Every pooled derivative goes to the maximum of its window, and through
+    # the ReLU if that maximum was positive
+    if x_cols is not None:
+        dout = dout.transpose(1, 0, 2, 3)
+    da = _max_pool_scatter(dout * positive, argmax, a_shape, pool_height,
+                           pool_width, pool_stride)
+
+    if x_cols is None:
+        return conv_backward_tiled(da, (x, w, b, conv_param, None))
+
+    _, _, out_h, out_w = a_shape
+    db = np.sum(da, axis=(1, 2, 3))
+    da = da.reshape(F, -1)
+    dw = da.dot(x_cols.T).reshape(w.shape)
+    dx_cols = w.reshape(F, -1).T.dot(da)
+    dx_cols.shape = (C, HH, WW, N, out_h, out_w)
+    dx = col2im_6d_fast(dx_cols, N, C, H, W, HH, WW, pad, stride)
+
+    return dx, dw, db
+
+
+def max_pool_forward_fast(x, pool_param):
+    """
+    A fast implementation of the forward pass for a max pooling layer.
+
+    This uses the strided method, which handles any window and stride and
+    only caches the argmax of every window, one byte per output for windows
+    of up to 256 elements. When the windows tile the input its backward pass
+    is a single put_along_axis.
+    """
+    out, strided_cache = max_pool_forward_strided(x, pool_param)
+    cache = ('strided', strided_cache)
     return out, cache
 
 
@@ -180,12 +1191,14 @@ def max_pool_backward_fast(dout, cache):
     """
     A fast implementation of the backward pass for a max pooling layer.
 
-    This switches between the reshape method an the im2col method depending on
-    which method was used to generate the cache.
+    This switches between the reshape, strided and im2col methods
+    depending on which method was used to generate the cache.
     """
     method, real_cache = cache
     if method == 'reshape':
         return max_pool_backward_reshape(dout, real_cache)
+    elif method == 'strided':
+        return max_pool_backward_strided(dout, real_cache)
     elif method == 'im2col':
         return max_pool_backward_im2col(dout, real_cache)
     else:
@@ -244,6 +1257,99 @@ def max_pool_backward_reshape(dout, cache):
     return dx
 
 
+def _max_pool_taps(x, pool_height, pool_width, stride):
+    """
+    Max pool the last two axes of x by looping over the pool_height *
+    pool_width offsets within a window, each a strided view of x.
+
+    Returns a tuple of:
+    - out: The maximum of every window.
+    - argmax: The offset i * pool_width + j within its window of the first
+      maximum of every window, in the smallest unsigned integer dtype that
+      holds it. Ties always go to the first offset in row-major order, like
+      np.argmax.
+    """
+    H, W = x.shape[-2:]
+    out_h = (H - pool_height) // stride + 1
+    out_w = (W - pool_width) // stride + 1
+    dtype = np.min_scalar_type(pool_height * pool_width - 1)
+
+    out = x[..., :stride * out_h:stride, :stride * out_w:stride].copy()
+    argmax = np.zeros(out.shape, dtype=dtype)
+    for i in range(pool_height):
+        for j in range(pool_width):
+            if i == 0 and j == 0:
+                continue
+            x_tap = x[..., i:i + stride * out_h:stride,
+                      j:j + stride * out_w:stride]
+            greater = x_tap > out
+            np.copyto(out, x_tap, where=greater)
+            np.copyto(argmax, i * pool_width + j, where=greater)
+    return out, argmax
+
+
+def _max_pool_scatter(dout, argmax, x_shape, pool_height, pool_width, stride):
+    """
+    The backward pass of _max_pool_taps: route every upstream derivative to
+    the input position its window's maximum came from. Windows that do not
+    overlap write to distinct positions, so the derivatives are assigned
+    directly; otherwise they are summed with np.bincount.
+    """
+    H, W = x_shape[-2:]
+    out_h, out_w = dout.shape[-2:]
+    M = int(np.prod(x_shape[:-2]))
+
+    # Index of the maximum of every window within its H * W plane
+    argmax = argmax.astype(np.intp)
+    rows = stride * np.arange(out_h).reshape(-1, 1) + argmax // pool_width
+    cols = stride * np.arange(out_w) + argmax % pool_width
+    index = (rows * W + cols).reshape(M, -1)
+
+    if stride >= pool_height and stride >= pool_width:
+        dx = np.zeros((M, H * W), dtype=dout.dtype)
+        np.put_along_axis(dx, index, dout.reshape(M, -1), axis=1)
+    else:
+        index += H * W * np.arange(M).reshape(-1, 1)
+        dx = np.bincount(index.ravel(), weights=dout.ravel(),
+                         minlength=M * H * W)
+        dx = dx.astype(dout.dtype, copy=False)
+    return dx.reshape(x_shape)
+
+
+def max_pool_forward_strided(x, pool_param):
+    """
+    A fast implementation of the forward pass for a max pooling layer with
+    any pooling window and stride, based on strided views of the input.
+
+    The cache holds the offset within its window of the maximum of every
+    output, in the smallest integer dtype that fits, rather than the input.
+    """
+    pool_height, pool_width = pool_param['pool_height'], pool_param['pool_width']
+    stride = pool_param['stride']
+    out, argmax = _max_pool_taps(x, pool_height, pool_width, stride)
+    cache = (x.shape, argmax, pool_param)
+    return out, cache
+
+
+def max_pool_backward_strided(dout, cache):
+    """
+    A fast implementation of the backward pass for a max pooling layer, for
+    the cache of max_pool_forward_strided. Every upstream derivative goes to
+    the first maximum of its window.
+    """
+    x_shape, argmax, pool_param = cache
+    pool_height, pool_width = pool_param['pool_height'], pool_param['pool_width']
+    stride = pool_param['stride']
+    return _max_pool_scatter(dout, argmax, x_shape, pool_height, pool_width,
+                             stride)
+
+
+# The argmax-only cache of max_pool_forward_strided is the low-memory pooling
+# mode; these names are kept for it.
+max_pool_forward_argmax = max_pool_forward_strided
+max_pool_backward_argmax = max_pool_backward_strided
+
+
 def max_pool_forward_im2col(x, pool_param):
     """
     An implementation of the forward pass for max pooling based on im2col.
@@ -262,7 +1368,8 @@ def max_pool_forward_im2col(x, pool_param):
     out_width = (W - pool_width) // stride + 1
 
     x_split = x.reshape(N * C, 1, H, W)
-    x_cols = im2col(x_split, pool_height, pool_width, padding=0, stride=stride)
+    x_cols = im2col_fast(x_split, pool_height, pool_width, padding=0,
+                         stride=stride)
     x_cols_argmax = np.argmax(x_cols, axis=0)
     x_cols_max = x_cols[x_cols_argmax, np.arange(x_cols.shape[1])]
     out = x_cols_max.reshape(out_height, out_width, N, C).transpose(2, 3, 0, 1)
@@ -1,14 +1,59 @@
 from builtins import range
+from collections import OrderedDict
+
 import numpy as np
 
 
+# Index tables built by get_im2col_indices, keyed on everything they depend
+# on, with the least recently used ones evicted beyond IM2COL_CACHE_SIZE.
+IM2COL_CACHE_SIZE = 32
+_im2col_cache = OrderedDict()
+_im2col_cache_stats = {'hits': 0, 'misses': 0}
+
+
+def im2col_cache_info():
+    """
+    Return a dictionary with the number of 'hits' and 'misses' of the index
+    table cache of get_im2col_indices, and its current and maximum 'size'.
+    """
+    return {
+      'hits': _im2col_cache_stats['hits'],
+      'misses': _im2col_cache_stats['misses'],
+      'size': len(_im2col_cache),
+      'maxsize': IM2COL_CACHE_SIZE,
+    }
+
+
+def im2col_cache_clear():
+    """ Empty the index table cache of get_im2col_indices """
+    _im2col_cache.clear()
+    _im2col_cache_stats['hits'] = _im2col_cache_stats['misses'] = 0
+
+
 def get_im2col_indices(x_shape, field_height, field_width, padding=1, stride=1):
-    # First figure out what the size of the output should be
+    """
+    Build the fancy-index arrays (k, i, j) such that x_padded[:, k, i, j]
+    gathers the columns of im2col from the padded input.
+
+    The tables do not depend on the batch size, and are cached for each
+    input shape, field size, padding and stride. They are stored in the
+    smallest integer dtype that holds them and are read-only, since the same
+    arrays are returned to every caller.
+    """
     N, C, H, W = x_shape
+    key = (C, H, W, field_height, field_width, padding, stride)
+    indices = _im2col_cache.get(key)
+    if indices is not None:
+        _im2col_cache_stats['hits'] += 1
+        _im2col_cache[key] = _im2col_cache.pop(key)
+        return indices
+    _im2col_cache_stats['misses'] += 1
+
+    # First figure out what the size of the output should be
     assert (H + 2 * padding - field_height) % stride == 0
-    assert (W + 2 * padding - field_height) % stride == 0
-    out_height = (H + 2 * padding - field_height) / stride + 1
-    out_width = (W + 2 * padding - field_width) / stride + 1
+    assert (W + 2 * padding - field_width) % stride == 0
+    out_height = (H + 2 * padding - field_height) // stride + 1
+    out_width = (W + 2 * padding - field_width) // stride + 1
 
     i0 = np.repeat(np.arange(field_height), field_width)
     i0 = np.tile(i0, C)
@@ -20,7 +65,17 @@ def get_im2col_indices(x_shape, field_height, field_width, padding=1, stride=1):
 
     k = np.repeat(np.arange(C), field_height * field_width).reshape(-1, 1)
 
-    return (k, i, j)
+    indices = []
+    for arr in (k, i, j):
+        arr = arr.astype(np.min_scalar_type(arr.max()))
+        arr.flags.writeable = False
+        indices.append(arr)
+    indices = tuple(indices)
+
+    _im2col_cache[key] = indices
+    while len(_im2col_cache) > IM2COL_CACHE_SIZE:
+        _im2col_cache.popitem(last=False)
+    return indices
 
 
 def im2col_indices(x, field_height, field_width, padding=1, stride=1):
@@ -40,7 +95,25 @@ def im2col_indices(x, field_height, field_width, padding=1, stride=1):
 
 def col2im_indices(cols, x_shape, field_height=3, field_width=3, padding=1,
                    stride=1):
-    """ An implementation of col2im based on fancy indexing and np.add.at """
+    """
+    An implementation of col2im, the adjoint of im2col_indices. It adds the
+    columns for each of the field_height * field_width kernel offsets to a
+    strided slice of the output; see col2im_strided.
+    """
+    N, C, H, W = x_shape
+    assert (H + 2 * padding - field_height) % stride == 0
+    assert (W + 2 * padding - field_width) % stride == 0
+    return col2im_strided(cols, N, C, H, W, field_height, field_width,
+                          padding, stride)
+
+
+def col2im_indices_add_at(cols, x_shape, field_height=3, field_width=3,
+                          padding=1, stride=1):
+    """
+    An implementation of col2im based on fancy indexing and np.add.at. This
+    was col2im_indices before it moved to kernel-offset loops, which are much
+    faster; it is kept for comparison.
+    """
     N, C, H, W = x_shape
     H_padded, W_padded = H + 2 * padding, W + 2 * padding
     x_padded = np.zeros((N, C, H_padded, W_padded), dtype=cols.dtype)
@@ -52,3 +125,71 @@ def col2im_indices(cols, x_shape, field_height=3, field_width=3, padding=1,
     if padding == 0:
         return x_padded
     return x_padded[:, :, padding:-padding, padding:-padding]
+
+
+def im2col_strided(x, field_height, field_width, padding=1, stride=1):
+    """
+    An implementation of im2col based on a strided view of the padded input.
+    It returns the same columns as im2col_indices and im2col_cython: row
+    (c, i, j) of the result holds input channel c at kernel offset (i, j), and
+    the columns are ordered by output position and then by image.
+    """
+    N, C, H, W = x.shape
+    p = padding
+    out_height = (H + 2 * p - field_height) // stride + 1
+    out_width = (W + 2 * p - field_width) // stride + 1
+    x_padded = np.pad(x, ((0, 0), (0, 0), (p, p), (p, p)), mode='constant')
+
+    sN, sC, sH, sW = x_padded.strides
+    shape = (C, field_height, field_width, out_height, out_width, N)
+    strides = (sC, sH, sW, stride * sH, stride * sW, sN)
+    x_stride = np.lib.stride_tricks.as_strided(x_padded, shape=shape,
+                                               strides=strides)
+    cols = np.ascontiguousarray(x_stride)
+    cols.shape = (C * field_height * field_width, -1)
+    return cols
+
+
+def col2im_strided(cols, N, C, H, W, field_height, field_width, padding=1,
+                   stride=1):
+    """
+    An implementation of col2im, the adjoint of im2col_strided, with the same
+    arguments as col2im_cython. Rather than scattering every element, it loops
+    over the field_height * field_width kernel offsets and adds the columns
+    for each offset to a strided slice of the padded output at once.
+    """
+    H_padded, W_padded = H + 2 * padding, W + 2 * padding
+    out_height = (H_padded - field_height) // stride + 1
+    out_width = (W_padded - field_width) // stride + 1
+    cols = cols.reshape(C, field_height, field_width, out_height, out_width, N)
+
+    # Accumulate with the images last to match the layout of cols
+    x_padded = np.zeros((C, H_padded, W_padded, N), dtype=cols.dtype)
+    for i in range(field_height):
+        i_end = i + stride * out_height
+        for j in range(field_width):
+            j_end = j + stride * out_width
+            x_padded[:, i:i_end:stride, j:j_end:stride] += cols[:, i, j]
+
+    x = x_padded[:, padding:padding + H, padding:padding + W]
+    return np.ascontiguousarray(x.transpose(3, 0, 1, 2))
+
+
+def col2im_6d_strided(cols, N, C, H, W, HH, WW, pad, stride):
+    """
+    Like col2im_strided, but for the columns of shape
+    (C, HH, WW, N, out_height, out_width) used by conv_backward_strides; it
+    has the same arguments as col2im_6d_cython.
+    """
+    H_padded, W_padded = H + 2 * pad, W + 2 * pad
+    out_height, out_width = cols.shape[4], cols.shape[5]
+
+    x_padded = np.zeros((C, N, H_padded, W_padded), dtype=cols.dtype)
+    for i in range(HH):
+        i_end = i + stride * out_height
+        for j in range(WW):
+            j_end = j + stride * out_width
+            x_padded[:, :, i:i_end:stride, j:j_end:stride] += cols[:, i, j]
+
+    x = x_padded[:, :, pad:pad + H, pad:pad + W]
+    return np.ascontiguousarray(x.transpose(1, 0, 2, 3))
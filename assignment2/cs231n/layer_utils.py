@@ -1,3 +1,5 @@
+import numpy as np
+
 from cs231n.layers import *
 from cs231n.fast_layers import *
 
@@ -42,7 +44,7 @@ def conv_relu_forward(x, w, b, conv_param):
     - out: Output from the ReLU
     - cache: Object to give to the backward pass
     """
-    a, conv_cache = conv_forward_fast(x, w, b, conv_param)
+    a, conv_cache = conv_forward(x, w, b, conv_param)
     out, relu_cache = relu_forward(a)
     cache = (conv_cache, relu_cache)
     return out, cache
@@ -54,12 +56,74 @@ def conv_relu_backward(dout, cache):
     """
     conv_cache, relu_cache = cache
     da = relu_backward(dout, relu_cache)
-    dx, dw, db = conv_backward_fast(da, conv_cache)
+    dx, dw, db = conv_backward(da, conv_cache)
     return dx, dw, db
 
 
+def grouped_conv_relu_forward(x, w, b, conv_param):
+    """
+    A convenience layer that performs a grouped convolution followed by a
+    ReLU; conv_param['groups'] gives the number of groups.
+
+    Inputs:
+    - x: Input to the convolutional layer
+    - w, b, conv_param: Weights and parameters for the convolutional layer
+
+    Returns a tuple of:
+    - out: Output from the ReLU
+    - cache: Object to give to the backward pass
+    """
+    a, conv_cache = grouped_conv_forward_fast(x, w, b, conv_param)
+    out, relu_cache = relu_forward(a)
+    cache = (conv_cache, relu_cache)
+    return out, cache
+
+
+def grouped_conv_relu_backward(dout, cache):
+    """
+    Backward pass for the grouped-conv-relu convenience layer.
+    """
+    conv_cache, relu_cache = cache
+    da = relu_backward(dout, relu_cache)
+    dx, dw, db = grouped_conv_backward_fast(da, conv_cache)
+    return dx, dw, db
+
+
+def depthwise_separable_conv_relu_forward(x, w_depth, b_depth, w_point,
+                                          b_point, conv_param):
+    """
+    A convenience layer that performs a depthwise-separable convolution
+    followed by a ReLU.
+
+    Inputs:
+    - x: Input to the convolutional layer
+    - w_depth, b_depth: Weights for the depthwise convolution
+    - w_point, b_point: Weights for the pointwise 1x1 convolution
+    - conv_param: Parameters for the depthwise convolution
+
+    Returns a tuple of:
+    - out: Output from the ReLU
+    - cache: Object to give to the backward pass
+    """
+    a, conv_cache = depthwise_separable_conv_forward(x, w_depth, b_depth,
+                                                     w_point, b_point,
+                                                     conv_param)
+    out, relu_cache = relu_forward(a)
+    cache = (conv_cache, relu_cache)
+    return out, cache
+
+
+def depthwise_separable_conv_relu_backward(dout, cache):
+    """
+    Backward pass for the depthwise-separable-conv-relu convenience layer.
+    """
+    conv_cache, relu_cache = cache
+    da = relu_backward(dout, relu_cache)
+    return depthwise_separable_conv_backward(da, conv_cache)
+
+
 def conv_bn_relu_forward(x, w, b, gamma, beta, conv_param, bn_param):
-    a, conv_cache = conv_forward_fast(x, w, b, conv_param)
+    a, conv_cache = conv_forward(x, w, b, conv_param)
     an, bn_cache = spatial_batchnorm_forward(a, gamma, beta, bn_param)
     out, relu_cache = relu_forward(an)
     cache = (conv_cache, bn_cache, relu_cache)
@@ -70,10 +134,68 @@ def conv_bn_relu_backward(dout, cache):
     conv_cache, bn_cache, relu_cache = cache
     dan = relu_backward(dout, relu_cache)
     da, dgamma, dbeta = spatial_batchnorm_backward(dan, bn_cache)
-    dx, dw, db = conv_backward_fast(da, conv_cache)
+    dx, dw, db = conv_backward(da, conv_cache)
     return dx, dw, db, dgamma, dbeta
 
 
+def _batchnorm_scale_shift(b, gamma, beta, bn_param):
+    """
+    Return (scale, shift) of shape (D,) such that in test mode batch
+    normalization of a + b is a * scale + shift.
+    """
+    D = b.shape[0]
+    eps = bn_param.get('eps', 1e-5)
+    running_mean = bn_param.get('running_mean', np.zeros(D, dtype=b.dtype))
+    running_var = bn_param.get('running_var', np.zeros(D, dtype=b.dtype))
+    scale = gamma / np.sqrt(running_var + eps)
+    shift = (b - running_mean) * scale + beta
+    return (np.broadcast_to(scale, (D,)).reshape(D),
+            np.broadcast_to(shift, (D,)).reshape(D))
+
+
+def fold_batchnorm_affine(w, b, gamma, beta, bn_param):
+    """
+    Fold a test-mode batch normalization layer into the affine layer that
+    feeds it, so that affine_forward(x, w_fold, b_fold) gives the same output
+    as batchnorm_forward(affine_forward(x, w, b), gamma, beta, bn_param) with
+    bn_param['mode'] == 'test'.
+
+    Inputs:
+    - w: Affine weights, of shape (D, M)
+    - b: Affine biases, of shape (M,)
+    - gamma, beta: Scale and shift parameters, scalars or of shape (M,)
+    - bn_param: The bn_param of the batch normalization layer, holding its
+      running_mean, running_var and eps.
+
+    Returns a tuple of:
+    - w_fold: Folded weights, of shape (D, M)
+    - b_fold: Folded biases, of shape (M,)
+    """
+    scale, shift = _batchnorm_scale_shift(b, gamma, beta, bn_param)
+    return (w * scale).astype(w.dtype), shift.astype(b.dtype)
+
+
+def fold_batchnorm_conv(w, b, gamma, beta, bn_param):
+    """
+    Fold a test-mode spatial batch normalization layer into the convolution
+    that feeds it, so that conv_relu_forward with the folded weights gives
+    the same output as conv_bn_relu_forward in test mode.
+
+    Inputs:
+    - w: Filter weights, of shape (F, C, HH, WW)
+    - b: Biases, of shape (F,)
+    - gamma, beta: Scale and shift parameters, of shape (F,)
+    - bn_param: The bn_param of the spatial batch normalization layer.
+
+    Returns a tuple of:
+    - w_fold: Folded filter weights, of shape (F, C, HH, WW)
+    - b_fold: Folded biases, of shape (F,)
+    """
+    scale, shift = _batchnorm_scale_shift(b, gamma, beta, bn_param)
+    w_fold = w * scale[:, None, None, None]
+    return w_fold.astype(w.dtype), shift.astype(b.dtype)
+
+
 def conv_relu_pool_forward(x, w, b, conv_param, pool_param):
     """
     Convenience layer that performs a convolution, a ReLU, and a pool.
@@ -86,20 +208,15 @@ def conv_relu_pool_forward(x, w, b, conv_param, pool_param):
     Returns a tuple of:
     - out: Output from the pooling layer
     - cache: Object to give to the backward pass
+
+    The three layers are fused into one kernel; see
+    fast_layers.conv_relu_pool_forward_fused.
     """
-    a, conv_cache = conv_forward_fast(x, w, b, conv_param)
-    s, relu_cache = relu_forward(a)
-    out, pool_cache = max_pool_forward_fast(s, pool_param)
-    cache = (conv_cache, relu_cache, pool_cache)
-    return out, cache
+    return conv_relu_pool_forward_fused(x, w, b, conv_param, pool_param)
 
 
 def conv_relu_pool_backward(dout, cache):
     """
     Backward pass for the conv-relu-pool convenience layer
     """
-    conv_cache, relu_cache, pool_cache = cache
-    ds = max_pool_backward_fast(dout, pool_cache)
-    da = relu_backward(ds, relu_cache)
-    dx, dw, db = conv_backward_fast(da, conv_cache)
-    return dx, dw, db
+    return conv_relu_pool_backward_fused(dout, cache)
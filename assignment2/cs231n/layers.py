@@ -200,7 +200,7 @@ def batchnorm_forward(x, gamma, beta, bn_param):
         sample_var = np.var(x, axis=0)
         
         running_mean = momentum*running_mean + (1-momentum)*sample_mean
-        running_var = momentum*sample_var + (1-momentum)*sample_var
+        running_var = momentum*running_var + (1-momentum)*sample_var
         
         xmu = (x - sample_mean)
         xmu_sqr = np.square(xmu)
@@ -231,7 +231,7 @@ def batchnorm_forward(x, gamma, beta, bn_param):
         #######################################################################
         # *****START OF YOUR CODE (DO NOT DELETE/MODIFY THIS LINE)*****
 
-        out = (x - running_mean)/np.sqrt(running_var)
+        out = (x - running_mean)/np.sqrt(running_var + eps)
         out = gamma*out + beta
         
         # *****END OF YOUR CODE (DO NOT DELETE/MODIFY THIS LINE)*****
@@ -747,7 +747,7 @@ def conv_backward_naive(dout, cache):
                 
                 in_row += s
     
-    dx = dx[:, :, 1:-1, 1:-1]
+    dx = dx[:, :, p:p + x.shape[2], p:p + x.shape[3]]
     # *****END OF YOUR CODE (DO NOT DELETE/MODIFY THIS LINE)*****
     ###########################################################################
     #                             END OF YOUR CODE                            #
@@ -755,6 +755,82 @@ def conv_backward_naive(dout, cache):
     return dx, dw, db
 
 
+def grouped_conv_forward_naive(x, w, b, conv_param):
+    """
+    A naive implementation of the forward pass for a grouped convolutional
+    layer.
+
+    The C input channels and the F filters are split into G groups of
+    consecutive channels and filters, and each filter only spans the C // G
+    input channels of its own group. With G = 1 this is an ordinary
+    convolutional layer; with G = C every filter sees a single channel, which
+    is a depthwise convolution.
+
+    Input:
+    - x: Input data of shape (N, C, H, W)
+    - w: Filter weights of shape (F, C // G, HH, WW)
+    - b: Biases, of shape (F,)
+    - conv_param: A dictionary with the keys of conv_forward_naive and
+      - 'groups': The number of groups G, which must divide both C and F.
+
+    Returns a tuple of:
+    - out: Output data, of shape (N, F, H', W') as for conv_forward_naive
+    - cache: (x, w, b, conv_param)
+    """
+    N, C, H, W = x.shape
+    F = w.shape[0]
+    G = conv_param.get('groups', 1)
+    assert C % G == 0 and F % G == 0, 'Invalid number of groups'
+    C_g, F_g = C // G, F // G
+
+    out = []
+    for g in range(G):
+        out_g, _ = conv_forward_naive(x[:, g * C_g:(g + 1) * C_g],
+                                      w[g * F_g:(g + 1) * F_g],
+                                      b[g * F_g:(g + 1) * F_g], conv_param)
+        out.append(out_g)
+    out = np.concatenate(out, axis=1)
+
+    cache = (x, w, b, conv_param)
+    return out, cache
+
+
+def grouped_conv_backward_naive(dout, cache):
+    """
+    A naive implementation of the backward pass for a grouped convolutional
+    layer.
+
+    Inputs:
+    - dout: Upstream derivatives.
+    - cache: A tuple of (x, w, b, conv_param) as in grouped_conv_forward_naive
+
+    Returns a tuple of:
+    - dx: Gradient with respect to x
+    - dw: Gradient with respect to w
+    - db: Gradient with respect to b
+    """
+    x, w, b, conv_param = cache
+    N, C, H, W = x.shape
+    F = w.shape[0]
+    G = conv_param.get('groups', 1)
+    C_g, F_g = C // G, F // G
+
+    dx, dw, db = [], [], []
+    for g in range(G):
+        cache_g = (x[:, g * C_g:(g + 1) * C_g], w[g * F_g:(g + 1) * F_g],
+                   b[g * F_g:(g + 1) * F_g], conv_param)
+        dx_g, dw_g, db_g = conv_backward_naive(
+            dout[:, g * F_g:(g + 1) * F_g], cache_g)
+        dx.append(dx_g)
+        dw.append(dw_g)
+        db.append(db_g)
+    dx = np.concatenate(dx, axis=1)
+    dw = np.concatenate(dw, axis=0)
+    db = np.concatenate(db, axis=0)
+
+    return dx, dw, db
+
+
 def max_pool_forward_naive(x, pool_param):
     """
     A naive implementation of the forward pass for a max-pooling layer.
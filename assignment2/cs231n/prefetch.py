@@ -0,0 +1,139 @@
+from __future__ import print_function
+from builtins import object
+import threading
+import time
+
+import numpy as np
+from six.moves import queue
+
+
+def gather_batch(X, indices, out):
+    """
+    Gather the rows of X at indices into the preallocated buffer out.
+
+    Inputs:
+    - X: Array of shape (N, d_1, ..., d_k), or a cs231n.data_utils.Dataset.
+    - indices: Integer array of shape (B,).
+    - out: Array of shape (B, d_1, ..., d_k) with the same dtype as X.
+
+    Returns:
+    - out, holding the batch.
+    """
+    if isinstance(X, np.ndarray):
+        # mode='clip' lets np.take write straight into out; with the default
+        # mode='raise' it gathers into a temporary first. Clipping would
+        # silently hide bad indices, so check them here instead.
+        indices = np.asarray(indices)
+        if indices.size and (indices.min() < 0 or indices.max() >= X.shape[0]):
+            raise IndexError('Batch index out of range')
+        return np.take(X, indices, axis=0, out=out, mode='clip')
+    return X.take(indices, axis=0, out=out)
+
+
+class BatchPrefetcher(object):
+    """
+    A BatchPrefetcher prepares minibatches on a background thread so that the
+    gather (and any dtype conversion or augmentation) of the next minibatches
+    overlaps with the forward and backward pass on the current one.
+
+    Batches are gathered into a ring of num_batches + 1 preallocated buffers:
+    up to num_batches of them hold batches that are ready, and one holds the
+    batch that was last handed out. That buffer is only reused once the next
+    batch is requested, so a batch must not be used after asking for the next
+    one.
+
+    The time the consumer spent blocked in the most recent call to next_batch
+    is available as prefetcher.wait_time.
+
+    Example usage:
+
+    prefetcher = BatchPrefetcher(X, y, batch_size, batch_indices)
+    for t in range(num_iterations):
+        X_batch, y_batch = prefetcher.next_batch()
+        ...
+    prefetcher.close()
+    """
+
+    def __init__(self, X, y, batch_size, batch_indices, num_batches=2,
+                 transform=None):
+        """
+        Inputs:
+        - X: Array of shape (N, d_1, ..., d_k), or a Dataset.
+        - y: Array of labels, of shape (N,).
+        - batch_size: Largest number of indices in a batch.
+        - batch_indices: Iterator yielding an integer array of indices for
+          each batch. The thread stops when it is exhausted.
+        - num_batches: Number of batches to prepare ahead of the consumer.
+        - transform: Optional function, such as a BatchAugmenter, that is
+          called as transform(X_batch, out=X_batch) on the background thread
+          to modify each gathered batch in place.
+        """
+        self.X = X
+        self.y = y
+        self.transform = transform
+        self.batch_indices = iter(batch_indices)
+        self.wait_time = 0.0
+
+        self.buffers = [np.empty((batch_size,) + tuple(X.shape[1:]),
+                                 dtype=X.dtype)
+                        for _ in range(num_batches + 1)]
+        self._free = queue.Queue()
+        self._ready = queue.Queue()
+        for i in range(len(self.buffers)):
+            self._free.put(i)
+        self._current = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+
+    def _run(self):
+        try:
+            for indices in self.batch_indices:
+                if isinstance(indices, slice):
+                    raise ValueError('BatchPrefetcher needs integer arrays '
+                                     'of indices, not slices')
+                # Wait for a free buffer, checking for close() now and then
+                i = None
+                while i is None:
+                    if self._stop.is_set():
+                        return
+                    try:
+                        i = self._free.get(timeout=0.1)
+                    except queue.Empty:
+                        pass
+                X_batch = gather_batch(self.X, indices,
+                                       self.buffers[i][:len(indices)])
+                if self.transform is not None:
+                    X_batch = self.transform(X_batch, out=X_batch)
+                self._ready.put((i, X_batch, self.y[indices]))
+            self._ready.put((None, StopIteration(), None))
+        except Exception as e:
+            self._ready.put((None, e, None))
+
+
+    def next_batch(self):
+        """
+        Return the next minibatch as a tuple (X_batch, y_batch), blocking until
+        it is ready. Exceptions raised on the background thread (including
+        StopIteration once batch_indices is exhausted) are re-raised here.
+        """
+        start = time.time()
+        if self._current is not None:
+            self._free.put(self._current)
+            self._current = None
+        i, X_batch, y_batch = self._ready.get()
+        self.wait_time = time.time() - start
+        if i is None:
+            raise X_batch
+        self._current = i
+        return X_batch, y_batch
+
+
+    def close(self):
+        """
+        Stop the background thread and wait for it to exit.
+        """
+        self._stop.set()
+        self._thread.join()
@@ -4,11 +4,15 @@ standard_library.install_aliases()
 from builtins import range
 from builtins import object
 import os
+import time
 import pickle as pickle
 
 import numpy as np
 
 from cs231n import optim
+from cs231n import checkpoint
+from cs231n.prefetch import BatchPrefetcher
+from cs231n.samplers import ContiguousSampler, get_sampler
 
 
 class Solver(object):
@@ -90,6 +94,9 @@ class Solver(object):
           'X_val': Array, shape (N_val, d_1, ..., d_k) of validation images
           'y_train': Array, shape (N_train,) of labels for training images
           'y_val': Array, shape (N_val,) of labels for validation images
+          X_train and X_val may also be cs231n.data_utils.Dataset objects, in
+          which case minibatches are read from them lazily so the data does
+          not have to fit in memory.
 
         Optional arguments:
         - update_rule: A string giving the name of an update rule in optim.py.
@@ -102,6 +109,13 @@ class Solver(object):
           learning rate is multiplied by this value.
         - batch_size: Size of minibatches used to compute loss and gradient
           during training.
+        - sampler: How minibatches are drawn; a Sampler or the name of one in
+          samplers.py. The default 'random' samples each minibatch with
+          replacement; 'permutation' visits every example once per epoch,
+          'stratified' additionally balances the classes in each minibatch
+          and 'contiguous' shuffles X_train and y_train in place every epoch
+          so that minibatches are slices of them. 'contiguous' can't be used
+          together with prefetch.
         - num_epochs: The number of epochs to run for during training.
         - print_every: Integer; training losses will be printed every
           print_every iterations.
@@ -113,6 +127,20 @@ class Solver(object):
           accuracy; default is None, which uses the entire validation set.
         - checkpoint_name: If not None, then save model checkpoints here every
           epoch.
+        - prefetch: Number of minibatches to prepare ahead of time on a
+          background thread while the model computes on the current one; the
+          default of 0 gathers each minibatch synchronously in _step.
+        - checkpoint_format: Either 'pickle' (the default), which pickles the
+          whole model to checkpoint_name_epoch_N.pkl, or 'weights', which
+          saves only the arrays of the model and optimizer state to
+          checkpoint_name_epoch_N.ckpt in the format of checkpoint.py. The
+          latter can be restored quickly with load_checkpoint.
+        - augment: Optional function applied to every training minibatch
+          before the forward pass, such as an augment.BatchAugmenter. It is
+          called as augment(X_batch) in _step, or as
+          augment(X_batch, out=X_batch) on the prefetch thread if prefetch is
+          used; in the first case it must not modify X_batch, which may be a
+          view of X_train. The augmenter is only ever called from one thread.
         """
         self.model = model
         self.X_train = data['X_train']
@@ -125,11 +153,15 @@ class Solver(object):
         self.optim_config = kwargs.pop('optim_config', {})
         self.lr_decay = kwargs.pop('lr_decay', 1.0)
         self.batch_size = kwargs.pop('batch_size', 100)
+        self.sampler = kwargs.pop('sampler', 'random')
         self.num_epochs = kwargs.pop('num_epochs', 10)
         self.num_train_samples = kwargs.pop('num_train_samples', 1000)
         self.num_val_samples = kwargs.pop('num_val_samples', None)
+        self.prefetch = kwargs.pop('prefetch', 0)
+        self.augment = kwargs.pop('augment', None)
 
         self.checkpoint_name = kwargs.pop('checkpoint_name', None)
+        self.checkpoint_format = kwargs.pop('checkpoint_format', 'pickle')
         self.print_every = kwargs.pop('print_every', 10)
         self.verbose = kwargs.pop('verbose', True)
 
@@ -144,6 +176,16 @@ class Solver(object):
             raise ValueError('Invalid update_rule "%s"' % self.update_rule)
         self.update_rule = getattr(optim, self.update_rule)
 
+        contiguous = (self.sampler == 'contiguous' or
+                      isinstance(self.sampler, ContiguousSampler))
+        if self.prefetch > 0 and contiguous:
+            raise ValueError('The contiguous sampler can\'t be used with '
+                             'prefetch')
+
+        if self.checkpoint_format not in ('pickle', 'weights'):
+            raise ValueError('Invalid checkpoint_format "%s"'
+                             % self.checkpoint_format)
+
         self._reset()
 
 
@@ -160,6 +202,23 @@ class Solver(object):
         self.train_acc_history = []
         self.val_acc_history = []
 
+        # Seconds spent waiting for data and seconds spent in total by each
+        # call to _step
+        self.data_time_history = []
+        self.step_time_history = []
+        self.prefetcher = None
+        self.batches = None
+
+        # Minibatches taken from a lazy Dataset are written into this buffer.
+        # Datasets are recognized by their take method rather than by type,
+        # so that importing the Solver does not import the dataset loaders.
+        self.X_batch_buffer = None
+        if (not isinstance(self.X_train, np.ndarray)
+                and hasattr(self.X_train, 'take')):
+            self.X_batch_buffer = np.empty(
+                (self.batch_size,) + self.X_train.shape[1:],
+                dtype=self.X_train.dtype)
+
         # Make a deep copy of the optim_config for each parameter
         self.optim_configs = {}
         for p in self.model.params:
@@ -172,11 +231,25 @@ class Solver(object):
         Make a single gradient update. This is called by train() and should not
         be called manually.
         """
+        start = time.time()
+
         # Make a minibatch of training data
-        num_train = self.X_train.shape[0]
-        batch_mask = np.random.choice(num_train, self.batch_size)
-        X_batch = self.X_train[batch_mask]
-        y_batch = self.y_train[batch_mask]
+        if self.prefetcher is not None:
+            X_batch, y_batch = self.prefetcher.next_batch()
+        else:
+            if self.batches is None:
+                self.batches = iter(get_sampler(self.sampler, self.X_train,
+                                                self.y_train, self.batch_size))
+            batch_mask = next(self.batches)
+            if self.X_batch_buffer is not None:
+                out = self.X_batch_buffer[:len(batch_mask)]
+                X_batch = self.X_train.take(batch_mask, out=out)
+            else:
+                X_batch = self.X_train[batch_mask]
+            y_batch = self.y_train[batch_mask]
+            if self.augment is not None:
+                X_batch = self.augment(X_batch)
+        self.data_time_history.append(time.time() - start)
 
         # Compute loss and gradient
         loss, grads = self.model.loss(X_batch, y_batch)
@@ -191,9 +264,14 @@ class Solver(object):
             self.model.params[p] = next_w
             self.optim_configs[p] = next_config
 
+        self.step_time_history.append(time.time() - start)
+
 
     def _save_checkpoint(self):
         if self.checkpoint_name is None: return
+        if self.checkpoint_format == 'weights':
+            self._save_weights_checkpoint()
+            return
         checkpoint = {
           'model': self.model,
           'update_rule': self.update_rule,
@@ -214,12 +292,47 @@ class Solver(object):
             pickle.dump(checkpoint, f)
 
 
+    def _save_weights_checkpoint(self):
+        meta = {
+          'update_rule': self.update_rule.__name__,
+          'lr_decay': self.lr_decay,
+          'optim_config': self.optim_config,
+          'batch_size': self.batch_size,
+          'num_train_samples': self.num_train_samples,
+          'num_val_samples': self.num_val_samples,
+          'epoch': self.epoch,
+          'loss_history': [float(v) for v in self.loss_history],
+          'train_acc_history': [float(v) for v in self.train_acc_history],
+          'val_acc_history': [float(v) for v in self.val_acc_history],
+        }
+        filename = '%s_epoch_%d.ckpt' % (self.checkpoint_name, self.epoch)
+        if self.verbose:
+            print('Saving checkpoint to "%s"' % filename)
+        checkpoint.save_checkpoint(filename, self.model, self.optim_configs,
+                                   meta)
+
+
+    def load_checkpoint(self, filename):
+        """
+        Restore the model, the optimizer state and the training history from a
+        checkpoint saved with checkpoint_format='weights'. The model must have
+        been constructed with the same architecture as the saved one; its
+        arrays are memory-mapped from the file rather than copied.
+        """
+        optim_configs, meta = checkpoint.load_checkpoint(filename, self.model)
+        self.optim_configs.update(optim_configs)
+        self.epoch = meta['epoch']
+        self.loss_history = list(meta['loss_history'])
+        self.train_acc_history = list(meta['train_acc_history'])
+        self.val_acc_history = list(meta['val_acc_history'])
+
+
     def check_accuracy(self, X, y, num_samples=None, batch_size=100):
         """
         Check accuracy of the model on the provided data.
 
         Inputs:
-        - X: Array of data, of shape (N, d_1, ..., d_k)
+        - X: Array of data, of shape (N, d_1, ..., d_k), or a Dataset
         - y: Array of labels, of shape (N,)
         - num_samples: If not None, subsample the data and only test the model
           on num_samples datapoints.
@@ -263,6 +376,32 @@ class Solver(object):
         iterations_per_epoch = max(num_train // self.batch_size, 1)
         num_iterations = self.num_epochs * iterations_per_epoch
 
+        if self.prefetch > 0:
+            # The sampler runs on the prefetch thread, concurrently with the
+            # model, so give it its own random state seeded from the global one
+            sampler = get_sampler(self.sampler, self.X_train, self.y_train,
+                                  self.batch_size,
+                                  seed=np.random.randint(2**31))
+            self.prefetcher = BatchPrefetcher(self.X_train, self.y_train,
+                                              self.batch_size, sampler,
+                                              num_batches=self.prefetch,
+                                              transform=self.augment)
+        try:
+            self._train(num_iterations, iterations_per_epoch)
+        finally:
+            if self.prefetcher is not None:
+                self.prefetcher.close()
+                self.prefetcher = None
+        self.batches = None
+
+        # At the end of training swap the best params into the model
+        self.model.params = self.best_params
+
+
+    def _train(self, num_iterations, iterations_per_epoch):
+        """
+        The optimization loop of train(). Don't call this manually.
+        """
         for t in range(num_iterations):
             self._step()
 
@@ -295,6 +434,13 @@ class Solver(object):
                 if self.verbose:
                     print('(Epoch %d / %d) train acc: %f; val_acc: %f' % (
                            self.epoch, self.num_epochs, train_acc, val_acc))
+                    if not first_it:
+                        steps = slice(-iterations_per_epoch, None)
+                        data_time = sum(self.data_time_history[steps])
+                        step_time = sum(self.step_time_history[steps])
+                        print('(Epoch %d / %d) waited for data %.1f%% of '
+                              'step time' % (self.epoch, self.num_epochs,
+                              100.0 * data_time / max(step_time, 1e-12)))
 
                 # Keep track of the best model
                 if val_acc > self.best_val_acc:
@@ -302,6 +448,3 @@ class Solver(object):
                     self.best_params = {}
                     for k, v in self.model.params.items():
                         self.best_params[k] = v.copy()
-
-        # At the end of training swap the best params into the model
-        self.model.params = self.best_params